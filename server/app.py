@@ -1,15 +1,37 @@
 import os
-import random
-import string
+import json
+import atexit
+import hashlib
+import hmac
 import logging
+import time
 from datetime import datetime, timedelta
-import re # Import regex module for search functionality
 from functools import wraps
+from urllib.parse import parse_qsl
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, Response, jsonify, request, make_response, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
+from werkzeug.middleware.proxy_fix import ProxyFix
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson.objectid import ObjectId
+from rank_engine import RankEngine
+from background import PeriodicTask
+from question_cache import QuestionBankCache, RecentQuestions
+import indexes
+import league_members
+import league_codes
+from league_search import LeagueSearchIndex
+from metrics import Metrics
+from rate_limit import MemoryBucketStore, MongoBucketStore, RateLimiter, parse_limits
+from health import HealthMonitor, PoolStatsListener
+import score_rollups
+import results_history
+from score_ingest import ScoreIngestQueue, LeagueTotalsStage
+from session_tokens import SessionTokens
+from ttl_cache import TTLCache
+from batch import BatchError, BatchRunner, FORWARDED_HEADERS, encode_results, parse_items
+from quiz_upload import UploadError, UploadStats, iter_json_list, iter_ndjson, load_and_swap
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,8 +39,20 @@ load_dotenv()
 # --- Configuration ---
 app = Flask(__name__)
 # Enable CORS for frontend communication and allow custom headers
+# Behind TRUSTED_PROXY_COUNT reverse proxies / load balancers, take the client
+# address from the Nth-from-right X-Forwarded-For hop (the one the outermost
+# trusted proxy saw). Entries further left are client-controlled and ignored.
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", 0))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
 CORS(app, resources={r"/api/*": {"origins": "*"}, r"/api/leagues/*": {"origins": "*"}}, supports_credentials=True, allow_headers=['Content-Type', 'Authorization', 'X-API-KEY', 'X-USER-ID'])
 
+# Per-route latency/size histograms and Mongo command timings, served at /api/metrics
+metrics = Metrics(slow_threshold_ms=int(os.environ.get("SLOW_REQUEST_MS", 500)))
+metrics.init_app(app)
+# Connection-pool counters for the readiness probe
+pool_stats = PoolStatsListener()
+
 # Securely retrieve configurations
 MONGO_URI = os.environ.get("MONGO_URI")
 ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY") 
@@ -30,27 +64,319 @@ if not ADMIN_API_KEY:
     print("FATAL ERROR: ADMIN_API_KEY environment variable not set. This is needed for admin operations.")
     exit(1)
 
-# Initialize MongoDB Client
+# Telegram init_data verification key, derived once from the bot token
+# (Mini App scheme: HMAC-SHA256 of the bot token keyed with "WebAppData")
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
+TELEGRAM_SECRET_KEY = hmac.new(b"WebAppData", TELEGRAM_BOT_TOKEN.encode(), hashlib.sha256).digest() if TELEGRAM_BOT_TOKEN else None
+# Signed init_data older than this (by its auth_date) is refused, so a captured
+# string cannot keep minting session tokens
+TELEGRAM_AUTH_MAX_AGE = int(os.environ.get("TELEGRAM_AUTH_MAX_AGE", 86400))
+# Verified init_data -> profile, so WebApp reloads within the window skip verification and MongoDB.
+# Entries never outlive their init_data's max age.
+auth_cache = TTLCache(
+    maxsize=int(os.environ.get("AUTH_CACHE_SIZE", 10000)),
+    ttl=min(int(os.environ.get("AUTH_CACHE_TTL", 300)), TELEGRAM_AUTH_MAX_AGE)
+)
+
+# Signed session tokens issued by auth_telegram and checked by user_required.
+# ALLOW_LEGACY_USER_ID keeps the old unauthenticated X-USER-ID/body/query
+# identification working for clients that do not send a token yet.
+session_tokens = SessionTokens(
+    os.environ.get("SESSION_SECRET") or ADMIN_API_KEY,
+    ttl=int(os.environ.get("SESSION_TTL", 7 * 24 * 3600)),
+    cache_size=int(os.environ.get("SESSION_CACHE_SIZE", 10000))
+)
+ALLOW_LEGACY_USER_ID = os.environ.get("ALLOW_LEGACY_USER_ID", "true").lower() in ('1', 'true', 'yes')
+
+# MongoDB connection pool settings (per worker process)
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", 50)),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", 5)),
+    "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 300000)),
+    "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+    "serverSelectionTimeoutMS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+    "socketTimeoutMS": int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 10000)),
+}
+
+RANK_SNAPSHOT_INTERVAL = int(os.environ.get("RANK_SNAPSHOT_INTERVAL", 3600))
+RANK_SYNC_INTERVAL = int(os.environ.get("RANK_SYNC_INTERVAL", 30))
+LEAGUE_SEARCH_REFRESH = int(os.environ.get("LEAGUE_SEARCH_REFRESH", 60))
+LEAGUE_SEARCH_REBUILD_INTERVAL = int(os.environ.get("LEAGUE_SEARCH_REBUILD_INTERVAL", 6 * 3600))
+LEAGUE_SEARCH_MAX_RESULTS = int(os.environ.get("LEAGUE_SEARCH_MAX_RESULTS", 50))
+STATUS_REFRESH_INTERVAL = int(os.environ.get("STATUS_REFRESH_INTERVAL", 10))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 20))
+# Routes whose responses stream and so cannot run inside /api/batch
+BATCH_STREAMED_PATHS = ('/api/admin/results/export',)
+
+# Token-bucket limits per route: {endpoint: {scope: [tokens per second, burst]}}.
+# "default" covers endpoints without an entry; {} turns limiting off for one.
+# RATE_LIMITS (JSON, same shape) overrides individual entries.
+DEFAULT_RATE_LIMITS = {
+    "default": {"ip": [20, 100]},
+    "auth_telegram": {"ip": [1, 10]},
+    "submit_score": {"user": [0.5, 10], "ip": [5, 50]},
+    "search_leagues": {"ip": [5, 20]},
+    "search_league_frontend": {"ip": [5, 20]},
+    "sample_questions": {"ip": [5, 20]},
+    "create_league": {"user": [0.1, 5]},
+    "check_join_league": {"user": [0.5, 10]},
+    "batch_requests": {"ip": [2, 10]},
+    # Probes and scrapes must never be throttled
+    "get_status": {},
+    "health_live": {},
+    "health_ready": {},
+    "get_metrics": {},
+}
+# Per-IP buckets key on request.remote_addr, which is only the client's address
+# when the app is reached directly or TRUSTED_PROXY_COUNT matches the proxies in
+# front of it. Otherwise every user shares the proxy's bucket, so the ip scope
+# stays off until RATE_LIMIT_BY_IP is set.
+RATE_LIMIT_BY_IP = os.environ.get("RATE_LIMIT_BY_IP", "false").lower() in ('1', 'true', 'yes')
+if RATE_LIMIT_BY_IP and not TRUSTED_PROXY_COUNT:
+    print("Warning: RATE_LIMIT_BY_IP is on with TRUSTED_PROXY_COUNT=0; per-IP limits see the proxy's address if one is in front of the app.")
 try:
-    client = MongoClient(MONGO_URI)
-    db = client.quiz_database
-    print("Successfully connected to MongoDB!")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
+    RATE_LIMITS = parse_limits(
+        dict(DEFAULT_RATE_LIMITS, **json.loads(os.environ.get("RATE_LIMITS") or "{}")),
+        scopes=('user', 'ip') if RATE_LIMIT_BY_IP else ('user',)
+    )
+except ValueError as e:
+    print(f"FATAL ERROR: invalid RATE_LIMITS: {e}")
     exit(1)
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() in ('1', 'true', 'yes')
+
+# Checked in before_request, ahead of every route's Mongo work. Registered
+# after metrics so rejected requests still show up in the latency histograms.
+# Buckets are per process unless RATE_LIMIT_BACKEND=mongo (see init_services).
+rate_limiter = RateLimiter(
+    MemoryBucketStore(maxsize=int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))),
+    RATE_LIMITS if RATE_LIMIT_ENABLED else {},
+    user_key=lambda: resolve_user_id()[0],
+    metrics=metrics
+)
+rate_limiter.init_app(app)
+
+# Per-process services. They are created by init_services() (via create_app())
+# rather than at import time, so a pre-forking server never shares a
+# MongoClient socket pool or background thread between worker processes.
+client = None
+db = None
+score_queue = None
+rank_engine = None
+window_ranks = None
+rank_snapshot = None
+rank_sync_task = None
+rank_snapshot_epoch = None
+rank_sync_since = None
+league_code_allocator = None
+league_search_index = None
+league_search_task = None
+league_search_rebuilt_at = None
+question_cache = None
+health_monitor = None
+health_task = None
+batch_runner = None
+
+
+def take_rank_snapshot():
+    global rank_snapshot
+    rank_snapshot = rank_engine.snapshot()
+    return rank_snapshot
+
+
+def _snapshot_epoch():
+    return int(time.time() // RANK_SNAPSHOT_INTERVAL)
+
+
+def sync_rank_engines():
+    """
+    Brings this worker's rank engines up to date with MongoDB.
+
+    Each gunicorn worker has its own engines, so points scored through other
+    workers only reach them here: users and current-bucket rollups updated
+    since the previous sync (with one interval of overlap for clock skew) are
+    re-read through the updated_at indexes. This worker's queue is flushed
+    first so its own rollups are in Mongo before they are re-read. When a
+    RANK_SNAPSHOT_INTERVAL boundary has passed, the previousRank snapshot is
+    retaken from the freshly synced engine, so every worker snapshots at the
+    same moments.
+    """
+    global rank_snapshot_epoch, rank_sync_since
+    started = datetime.utcnow()
+    since = rank_sync_since - timedelta(seconds=RANK_SYNC_INTERVAL)
+    rank_engine.sync_from_collection(db.users, since)
+    try:
+        score_queue.flush()
+        window_ranks.sync(since)
+    except Exception as e:
+        print(f"Error syncing window rank engines: {e}")
+    rank_sync_since = started
 
-# --- Utility Functions ----
+    epoch = _snapshot_epoch()
+    if epoch != rank_snapshot_epoch:
+        take_rank_snapshot()
+        rank_snapshot_epoch = epoch
+
+
+def refresh_league_search():
+    """
+    Indexes public leagues created since the last refresh (on any worker).
+    Leagues are never edited by the app, so the full rebuild that would pick
+    up out-of-band edits only runs every LEAGUE_SEARCH_REBUILD_INTERVAL seconds.
+    """
+    global league_search_rebuilt_at
+    if time.monotonic() - league_search_rebuilt_at >= LEAGUE_SEARCH_REBUILD_INTERVAL:
+        league_search_index.rebuild_from_collection(db.leagues)
+        league_search_rebuilt_at = time.monotonic()
+    else:
+        league_search_index.refresh_from_collection(db.leagues, overlap=LEAGUE_SEARCH_REFRESH)
+
+
+def connect_mongo():
+    """Creates this process's MongoClient and warms the pool with a ping."""
+    mongo_client = MongoClient(MONGO_URI, event_listeners=[metrics.command_listener, pool_stats], **MONGO_POOL_OPTIONS)
+    mongo_client.admin.command('ping')
+    return mongo_client
+
+
+def init_services():
+    """Connects to MongoDB and starts the in-process engines and background jobs."""
+    global client, db, score_queue, rank_engine, window_ranks, rank_snapshot, rank_snapshot_epoch
+    global rank_sync_task, rank_sync_since
+    global league_code_allocator, league_search_index, league_search_task, league_search_rebuilt_at, question_cache
+    global health_monitor, health_task, batch_runner
+
+    # Initialize MongoDB Client
+    try:
+        client = connect_mongo()
+        db = client.quiz_database
+        print(f"Successfully connected to MongoDB! (pid {os.getpid()}, maxPoolSize {MONGO_POOL_OPTIONS['maxPoolSize']})")
+    except Exception as e:
+        print(f"Error connecting to MongoDB: {e}")
+        exit(1)
+
+    # Indexes every route depends on (see indexes.py); optionally verify query plans
+    for collection_name, error in indexes.ensure_indexes(db).items():
+        print(f"Error creating indexes on {collection_name}: {error}")
+    if os.environ.get("INDEX_SELF_CHECK", "").lower() in ('1', 'true', 'yes'):
+        try:
+            indexes.assert_no_collscans(db)
+            print("Query plan self-check passed.")
+        except indexes.IndexCheckError as e:
+            print(f"FATAL ERROR: {e}")
+            exit(1)
+
+    # Serialized question bank, rebuilt after upload_quiz or every QUESTION_CACHE_TTL seconds
+    question_cache = QuestionBankCache(load_questions, app.json.dumps, ttl=int(os.environ.get("QUESTION_CACHE_TTL", 300)))
+
+    # Write-behind queue for result rows, league totals and window rollups
+    # (submit_score writes overall_score itself). Results spilled by the previous
+    # shutdown are replayed before the rank engine is seeded.
+    score_queue = ScoreIngestQueue(
+        db,
+        flush_size=int(os.environ.get("SCORE_FLUSH_SIZE", 500)),
+        flush_interval=float(os.environ.get("SCORE_FLUSH_INTERVAL", 1.0)),
+        spill_path=os.environ.get("SCORE_SPILL_PATH", "score_ingest_spill.ndjson"),
+        stages=[LeagueTotalsStage(), score_rollups.RollupStage()]
+    )
+    try:
+        replayed = score_queue.replay_spill()
+        if replayed:
+            print(f"Replayed {replayed} spilled score results.")
+    except Exception as e:
+        print(f"Error replaying spilled score results: {e}")
+    score_queue.start()
+
+    # Seed the in-process rank engine used by score submission and the leaderboard
+    rank_engine = RankEngine()
+    try:
+        seeded = rank_engine.seed_from_collection(db.users)
+        print(f"Rank engine seeded with {seeded} users.")
+    except Exception as e:
+        print(f"Error seeding rank engine: {e}")
+
+    # Rank engines for the day/week/season leaderboards, seeded lazily per bucket
+    window_ranks = score_rollups.WindowRanks(db.score_rollups, preseed_ahead=2 * RANK_SYNC_INTERVAL)
+
+    # Every worker keeps its own engines; sync_rank_engines() pulls in what the
+    # other workers wrote every RANK_SYNC_INTERVAL seconds. Rank snapshots give
+    # the leaderboard its previousRank column: one is taken at startup and then
+    # at every RANK_SNAPSHOT_INTERVAL wall-clock boundary (default hourly).
+    rank_snapshot = rank_engine.snapshot()
+    rank_snapshot_epoch = _snapshot_epoch()
+    rank_sync_since = datetime.utcnow()
+    rank_sync_task = PeriodicTask('rank-sync', RANK_SYNC_INTERVAL, sync_rank_engines).start()
+
+    # League membership lives in league_members; move any legacy embedded arrays over (once per database)
+    try:
+        migrated = league_members.ensure_members_migrated(db)
+        if migrated:
+            print(f"Migrated membership of {migrated} leagues to league_members.")
+    except Exception as e:
+        print(f"Error preparing league membership: {e}")
+
+    # Private league codes: Feistel-permuted counter, unique index on leagues.code
+    league_code_allocator = league_codes.LeagueCodeAllocator(
+        db.counters,
+        os.environ.get("LEAGUE_CODE_SECRET") or ADMIN_API_KEY,
+        block_size=int(os.environ.get("LEAGUE_CODE_BLOCK_SIZE", 100))
+    )
+
+    # Prefix index for public league search, kept current by create_league and
+    # refreshed from Mongo every LEAGUE_SEARCH_REFRESH seconds so leagues created on
+    # other workers show up too (see refresh_league_search).
+    league_search_index = LeagueSearchIndex()
+    try:
+        indexed = league_search_index.rebuild_from_collection(db.leagues)
+        print(f"League search index built with {indexed} public leagues.")
+    except Exception as e:
+        print(f"Error building league search index: {e}")
+    league_search_rebuilt_at = time.monotonic()
+    league_search_task = PeriodicTask('league-search-refresh', LEAGUE_SEARCH_REFRESH, refresh_league_search).start()
+
+    # Status snapshot for /api/status and the readiness probe, refreshed off the request path
+    health_monitor = HealthMonitor(client, db, pool_stats, interval=STATUS_REFRESH_INTERVAL)
+    health_monitor.refresh()
+    health_task = PeriodicTask('health-refresh', STATUS_REFRESH_INTERVAL, health_monitor.refresh).start()
+
+    # Share rate-limit buckets across workers through Mongo instead of per process
+    if os.environ.get("RATE_LIMIT_BACKEND", "memory").lower() == "mongo":
+        rate_limiter.store = MongoBucketStore(db.rate_limits, idle_ttl=int(os.environ.get("RATE_LIMIT_IDLE_TTL", 3600)))
+
+    # Thread pool for the sub-requests of /api/batch
+    batch_runner = BatchRunner(app, max_workers=int(os.environ.get("BATCH_WORKERS", 8)))
+
+    metrics.gauge('score_queue_pending', 'Score results waiting for the next flush.', lambda: len(score_queue))
+    metrics.gauge('rank_engine_users', 'Users tracked by the in-process rank engine.', lambda: len(rank_engine))
+    metrics.gauge('league_search_index_leagues', 'Public leagues in the search index.', lambda: len(league_search_index))
+
+
+def shutdown_services():
+    """Stops background jobs, drains the score queue and closes the Mongo pool. Safe to call twice."""
+    global client
+    for task in (rank_sync_task, league_search_task, health_task):
+        if task is not None:
+            task.stop()
+    if batch_runner is not None:
+        batch_runner.shutdown()
+    if score_queue is not None:
+        score_queue.close()
+    if client is not None:
+        client.close()
+        client = None
+
+
+def create_app():
+    """
+    Application factory for WSGI servers (see gunicorn.conf.py). Call it in
+    each worker process after fork; services are initialized once per process.
+    """
+    if db is None:
+        init_services()
+        atexit.register(shutdown_services)
+    return app
 
-def generate_unique_code(collection):
-    """Generates a unique 6-digit alphanumeric code for private leagues."""
-    characters = string.ascii_uppercase + string.digits
-    MAX_ATTEMPTS = 10
-    for _ in range(MAX_ATTEMPTS):
-        code = ''.join(random.choice(characters) for _ in range(6))
-        # Check if the code already exists in the database
-        if collection.find_one({"code": code}) is None:
-            return code
-    raise Exception("Could not generate a unique league code after several attempts.")
+
+# --- Utility Functions ----
 
 # --- Authentication Decorators ---
 
@@ -70,34 +396,54 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def resolve_user_id():
+    """
+    Returns (user_id, error_message) for the current request.
+
+    A bearer session token in the Authorization header is verified from the
+    header alone. Without one, and only while ALLOW_LEGACY_USER_ID is on, the
+    user id is taken from the X-USER-ID header, JSON body or query string.
+    """
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        user_id = session_tokens.verify(auth_header[7:].strip())
+        if not user_id:
+            return None, "Authentication Failed: Invalid or expired session token."
+        return user_id, None
+
+    if not ALLOW_LEGACY_USER_ID:
+        return None, "Authentication Required: Missing session token (Authorization: Bearer header)."
+
+    # Allow user id to be passed via header, JSON body, or query param to match frontend usage
+    # 1) header
+    user_id = request.headers.get('X-USER-ID')
+    # 2) JSON body
+    if not user_id:
+        try:
+            body = request.get_json(silent=True) or {}
+        except Exception:
+            body = {}
+        user_id = body.get('user_id') or body.get('creator_id') or body.get('userId')
+    # 3) query param
+    if not user_id:
+        user_id = request.args.get('user_id') or request.args.get('userId')
+
+    if not user_id:
+        return None, "Authentication Required: Missing user identifier (session token, X-USER-ID header, user_id body, or user_id query)."
+    return user_id, None
+
+
 def user_required(f):
     """
-    Decorator to mock user authentication by requiring an 'X-User-ID' header.
-    This simulates a successful login where the backend receives the user's ID
-    for specific data operations (like managing leagues).
+    Decorator requiring an authenticated user, resolved by resolve_user_id():
+    a signed session token from auth_telegram, or the legacy user identifier
+    while ALLOW_LEGACY_USER_ID is enabled.
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        # Allow user id to be passed via header, JSON body, or query param to match frontend usage
-        user_id = None
-        # 1) header
-        user_id = request.headers.get('X-USER-ID')
-        # 2) JSON body
-        if not user_id:
-            try:
-                body = request.get_json(silent=True) or {}
-            except Exception:
-                body = {}
-            user_id = body.get('user_id') or body.get('creator_id') or body.get('userId')
-        # 3) query param
+        user_id, error = resolve_user_id()
         if not user_id:
-            user_id = request.args.get('user_id') or request.args.get('userId')
-
-        if not user_id:
-            return make_response(
-                jsonify({"message": "Authentication Required: Missing user identifier (X-USER-ID header, user_id body, or user_id query)."}),
-                401
-            )
+            return make_response(jsonify({"message": error}), 401)
 
         # Pass the extracted user_id to the decorated function
         return f(user_id, *args, **kwargs)
@@ -107,81 +453,172 @@ def user_required(f):
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    """Simple status check route."""
-    try:
-        client.admin.command('ping')
-        db_status = "Connected"
-        quiz_count = db.questions.count_documents({})
-    except Exception:
-        db_status = "Failed"
-        quiz_count = 0
-
+    """Simple status check route, served from the background-refreshed health snapshot."""
+    status = health_monitor.status()
     return jsonify({
         "status": "Server Running",
-        "database": db_status,
-        "quiz_count": quiz_count
+        "database": status['database'],
+        "quiz_count": status['quiz_count']
     })
 
-@app.route('/api/questions', methods=['GET'])
-def get_questions():
-    """Fetches a list of quiz questions."""
-    questions_collection = db.questions
-    questions_cursor = questions_collection.find({})
-    
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    """Liveness probe: the process is serving requests. Never touches MongoDB."""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness probe: 200 while the cached MongoDB check is fresh and passing, else 503."""
+    status = health_monitor.status()
+    ready = health_monitor.ready()
+    return jsonify({
+        "status": "ready" if ready else "not ready",
+        "database": status['database'],
+        "checked_at": status['checked_at'],
+        "pool": status.get('pool'),
+        "error": status.get('error')
+    }), 200 if ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text-format metrics for this worker process."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def load_questions():
+    """Reads the full question bank with _id stringified for JSON."""
     questions_list = []
-    for q in questions_cursor:
+    for q in db.questions.find({}):
         # Convert MongoDB's ObjectId to a string for JSON serialization
         q['_id'] = str(q.get('_id', ''))
         questions_list.append(q)
+    return questions_list
+
+
+@app.route('/api/questions', methods=['GET'])
+def get_questions():
+    """Fetches the quiz questions from the pre-serialized question bank cache.
+
+    Supports If-None-Match (304 when the bank is unchanged) and serves a
+    precompressed brotli or gzip body when the client accepts it.
+    """
+    bank = question_cache.get()
+
+    if request.if_none_match.contains(bank.etag):
+        response = make_response('', 304)
+    else:
+        accepted = request.accept_encodings
+        if bank.brotli_body is not None and accepted['br']:
+            body, encoding = bank.brotli_body, 'br'
+        elif accepted['gzip']:
+            body, encoding = bank.gzip_body, 'gzip'
+        else:
+            body, encoding = bank.body, None
+        response = make_response(body, 200)
+        response.mimetype = 'application/json'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(bank.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+QUESTION_SAMPLE_MAX = 50
+# Question ids recently served to each user by /api/questions/sample
+recent_questions = RecentQuestions(per_user=int(os.environ.get("QUESTION_RECENT_WINDOW", 200)))
+
+
+@app.route('/api/questions/sample', methods=['GET'])
+def sample_questions():
+    """
+    Returns a random subset of n questions, optionally filtered by category and
+    difficulty, using server-side $sample. When the caller identifies itself
+    (session token, or the legacy user id), questions it was served recently are
+    skipped until the filtered pool runs dry.
+    """
+    try:
+        n = max(1, min(int(request.args.get('n', 10)), QUESTION_SAMPLE_MAX))
+    except ValueError:
+        return jsonify({"message": "n must be an integer."}), 400
+
+    match = {}
+    if request.args.get('category'):
+        match['category'] = request.args.get('category')
+    if request.args.get('difficulty'):
+        match['difficulty'] = request.args.get('difficulty')
+    user_id, _ = resolve_user_id()
+
+    try:
+        questions_collection = db.questions
+        sampled = []
+        if user_id:
+            recent = recent_questions.get(user_id)
+            if recent:
+                fresh_match = dict(match, _id={'$nin': recent})
+                sampled = list(questions_collection.aggregate([{'$match': fresh_match}, {'$sample': {'size': n}}]))
+        if len(sampled) < n:
+            # Not enough unseen questions (or no user): top up from the whole filtered pool
+            seen = [q['_id'] for q in sampled]
+            top_up_match = dict(match, _id={'$nin': seen}) if seen else match
+            sampled += list(questions_collection.aggregate([{'$match': top_up_match}, {'$sample': {'size': n - len(sampled)}}]))
+
+        if user_id:
+            recent_questions.add(user_id, [q['_id'] for q in sampled])
+        for q in sampled:
+            q['_id'] = str(q.get('_id', ''))
+        return jsonify(sampled), 200
+    except Exception as e:
+        print(f"Error sampling questions: {e}")
+        return jsonify({"message": "Error sampling questions."}), 500
+
+
+def run_league_search(query_string, default_limit):
+    """
+    Shared implementation of the league search routes: ranked ids from the
+    prefix index, then one $in lookup for the display fields. The caller may
+    pass ?limit= up to LEAGUE_SEARCH_MAX_RESULTS.
+    """
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        limit = default_limit
+    limit = max(1, min(limit, LEAGUE_SEARCH_MAX_RESULTS))
+
+    league_ids = league_search_index.search(query_string, limit)
+    if not league_ids:
+        return []
+
+    leagues_cursor = db.leagues.find(
+        {"_id": {"$in": [ObjectId(lid) for lid in league_ids]}, "is_private": False},
+        {"name": 1, "description": 1, "member_count": 1}
+    )
+    by_id = {str(league['_id']): league for league in leagues_cursor}
+
+    leagues_list = []
+    for league_id in league_ids:
+        league = by_id.get(league_id)
+        if league is None:
+            continue
+        leagues_list.append({
+            "league_id": league_id,
+            "name": league.get('name'),
+            "description": league.get('description'),
+            "member_count": league.get('member_count', 0),
+        })
+    return leagues_list
 
-    return jsonify(questions_list)
 
 @app.route('/api/leagues/search', methods=['GET'])
 def search_leagues():
     """
     Searches for public leagues based on an optional query string (q).
-    Returns league name, description, and member count.
+    Returns league name, description, and member count, best match first.
     """
-    leagues_collection = db.leagues
-    
-    # Get the search query from URL parameters
     query_string = request.args.get('q', '').strip()
-    
-    # Base query: must be a public league
-    mongo_query = {"is_private": False}
-    
-    if query_string:
-        # Create a regex pattern for case-insensitive search
-        regex_pattern = re.compile(query_string, re.IGNORECASE)
-        
-        # Add OR condition to search name or description
-        mongo_query['$or'] = [
-            {"name": {"$regex": regex_pattern}},
-            {"description": {"$regex": regex_pattern}}
-        ]
-
     try:
-        leagues_cursor = leagues_collection.find(mongo_query)
-        
-        leagues_list = []
-        for league in leagues_cursor:
-            
-            # Count members safely
-            member_count = len(league.get('members', []))
-            
-            # Prepare the public-facing league data
-            leagues_list.append({
-                "league_id": str(league.get('_id')),
-                "name": league.get('name'),
-                "description": league.get('description'),
-                "member_count": member_count,
-            })
-            # Limiting to 3 results as requested for display demonstration
-            if len(leagues_list) >= 3:
-                 break
-
-        return jsonify(leagues_list), 200
-
+        # 3 results by default, as used for display demonstration
+        return jsonify(run_league_search(query_string, 3)), 200
     except Exception as e:
         print(f"Error during league search: {e}")
         return jsonify({"message": f"An unexpected error occurred during league search: {e}"}), 500
@@ -190,31 +627,11 @@ def search_leagues():
 # Backwards-compatible single-route used by frontend: /api/league/search?query=...
 @app.route('/api/league/search', methods=['GET'])
 def search_league_frontend():
-    # Map 'query' (frontend) to our implementation that expects 'q'
+    # Map 'query' (frontend) to the shared search implementation
     q = request.args.get('query')
-    # Build args for internal function and call it by reusing logic
-    # Simpler: call search_leagues but temporarily set request args
-    # We'll just reuse the same logic here for parity
-    leagues_collection = db.leagues
     query_string = q.strip() if q else ''
-    mongo_query = {"is_private": False}
-    if query_string:
-        regex_pattern = re.compile(query_string, re.IGNORECASE)
-        mongo_query['$or'] = [{"name": {"$regex": regex_pattern}}, {"description": {"$regex": regex_pattern}}]
     try:
-        leagues_cursor = leagues_collection.find(mongo_query)
-        leagues_list = []
-        for league in leagues_cursor:
-            member_count = len(league.get('members', []))
-            leagues_list.append({
-                "league_id": str(league.get('_id')),
-                "name": league.get('name'),
-                "description": league.get('description'),
-                "member_count": member_count,
-            })
-            if len(leagues_list) >= 10:
-                break
-        return jsonify(leagues_list), 200
+        return jsonify(run_league_search(query_string, 10)), 200
     except Exception as e:
         print(f"Error during league search (frontend route): {e}")
         return jsonify({"message": "Error searching leagues."}), 500
@@ -225,31 +642,100 @@ def search_league_frontend():
 @app.route('/api/admin/quiz/upload', methods=['POST'])
 @admin_required
 def upload_quiz():
-    """Accepts a list of quiz questions, clears the old collection, and inserts the new data."""
-    questions_collection = db.questions
-    
+    """
+    Replaces the question bank.
+
+    Accepts either a JSON list of question objects or, with an
+    application/x-ndjson content type, one question object per line streamed
+    in chunks. Records are validated as they arrive and written in batches to
+    a staging collection that is atomically renamed over the live one, so
+    readers never see an empty or partial bank.
+    """
+    stats = UploadStats()
+    batch_size = int(os.environ.get("QUIZ_UPLOAD_BATCH_SIZE", 1000))
+
     try:
-        data = request.get_json()
-        
-        if not data or not isinstance(data, list) or not data:
-            return jsonify({"message": "Invalid data format. Expected a non-empty list of question objects."}), 400
+        if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+            records = iter_ndjson(request.stream, stats)
+        else:
+            data = request.get_json(silent=True)
+            stats.bytes = request.content_length or 0
+            records = iter_json_list(data)
 
-        # 1. Clear the existing questions collection
-        delete_result = questions_collection.delete_many({})
-        
-        # 2. Insert the new quiz questions
-        insert_result = questions_collection.insert_many(data)
-        
-        return jsonify({
+        deleted_count = load_and_swap(db, 'questions', records, stats, batch_size=batch_size, prepare=lambda staging: indexes.ensure_collection_indexes(staging, 'questions'))
+        question_cache.invalidate()
+
+        response = {
             "message": "Quiz questions successfully updated.",
-            "inserted_count": len(insert_result.inserted_ids),
-            "deleted_count": delete_result.deleted_count
-        }), 201
+            "deleted_count": deleted_count
+        }
+        response.update(stats.as_dict())
+        return jsonify(response), 201
 
+    except UploadError as e:
+        return jsonify({"message": e.message, "line": e.line}), 400
     except Exception as e:
         print(f"Error during quiz upload: {e}")
         return jsonify({"message": f"An unexpected error occurred during database operation: {e}"}), 500
 
+@app.route('/api/admin/leaderboard/verify', methods=['POST'])
+@admin_required
+def verify_leaderboard():
+    """Checks the in-process rank engine against MongoDB. Pass ?repair=1 to reseed on mismatch."""
+    try:
+        repair = request.args.get('repair', '').lower() in ('1', 'true', 'yes')
+        report = rank_engine.verify_against(db.users, repair=repair)
+        return jsonify(report), 200
+    except Exception as e:
+        print(f"Error during leaderboard verification: {e}")
+        return jsonify({"message": f"An unexpected error occurred during leaderboard verification: {e}"}), 500
+
+@app.route('/api/admin/leaderboard/snapshot', methods=['POST'])
+@admin_required
+def snapshot_leaderboard():
+    """Takes a rank snapshot now; the leaderboard's previousRank compares against it."""
+    try:
+        snapshot = take_rank_snapshot()
+        return jsonify({
+            "message": "Rank snapshot taken.",
+            "user_count": len(snapshot),
+            "taken_at": snapshot.taken_at.isoformat()
+        }), 201
+    except Exception as e:
+        print(f"Error taking rank snapshot: {e}")
+        return jsonify({"message": f"An unexpected error occurred while taking the rank snapshot: {e}"}), 500
+
+@app.route('/api/admin/leagues/codes/stats', methods=['GET'])
+@admin_required
+def league_code_stats():
+    """Reports the league code allocator's reserved pool depth and collision counts."""
+    return jsonify(league_code_allocator.stats()), 200
+
+@app.route('/api/admin/scores/flush', methods=['POST'])
+@admin_required
+def flush_scores():
+    """Flushes the score ingest queue now and reports its counters."""
+    try:
+        written = score_queue.flush()
+        stats = score_queue.stats()
+        stats['written'] = written
+        return jsonify(stats), 200
+    except Exception as e:
+        print(f"Error flushing score queue: {e}")
+        return jsonify({"message": f"An unexpected error occurred while flushing scores: {e}"}), 500
+
+@app.route('/api/admin/indexes/check', methods=['GET'])
+@admin_required
+def check_indexes():
+    """Explains each route's query shape; responds 500 if any plan is a COLLSCAN."""
+    try:
+        reports = indexes.check_query_plans(db)
+        ok = all(r['collscan'] is False for r in reports)
+        return jsonify({"ok": ok, "routes": reports}), 200 if ok else 500
+    except Exception as e:
+        print(f"Error during index check: {e}")
+        return jsonify({"message": f"An unexpected error occurred during index check: {e}"}), 500
+
 # --- League Management Routes (Protected by user_required) ---
 
 @app.route('/api/leagues/create', methods=['POST'])
@@ -276,15 +762,20 @@ def create_league(user_id):
             "creator_id": user_id,
             "is_private": is_private,
             "code": None,
-            "members": [user_id] # Creator is automatically the first member
+            "member_count": 0,
+            "points": 0
         }
 
         if is_private:
-            # Generate and assign a unique 6-digit code
-            unique_code = generate_unique_code(leagues_collection)
-            league_data['code'] = unique_code
-        
-        insert_result = leagues_collection.insert_one(league_data)
+            # Allocate a unique 6-character code and insert optimistically against the unique index
+            insert_result = league_code_allocator.insert_with_code(leagues_collection, league_data)
+            unique_code = league_data['code']
+        else:
+            insert_result = leagues_collection.insert_one(league_data)
+        # Creator is automatically the first member
+        league_members.add_member(db, insert_result.inserted_id, user_id)
+        if not is_private:
+            league_search_index.upsert(insert_result.inserted_id, league_data['name'], league_data['description'])
         
         response = {
             "message": "League created successfully.",
@@ -318,13 +809,13 @@ def check_join_league(user_id):
             return jsonify({"message": "Code must be exactly 6 characters long."}), 400
         
         # Find the league by the unique code, ensuring it is a private league
-        league = leagues_collection.find_one({"code": code, "is_private": True})
+        league = leagues_collection.find_one({"code": code, "is_private": True}, {"name": 1, "description": 1})
         
         if not league:
             return jsonify({"message": "No private league found with that code."}), 404
 
         # Check if the user is already a member
-        is_member = user_id in league.get('members', [])
+        is_member = league_members.is_member(db, league['_id'], user_id)
         
         # Return public-facing details for confirmation
         return jsonify({
@@ -343,7 +834,7 @@ def check_join_league(user_id):
 @app.route('/api/leagues/join/confirm', methods=['POST'])
 @user_required
 def confirm_join_league(user_id):
-    """Confirms the join action and adds the user to the league's member list."""
+    """Confirms the join action and adds the user to the league's members."""
     leagues_collection = db.leagues
     
     try:
@@ -353,94 +844,170 @@ def confirm_join_league(user_id):
         if len(code) != 6:
             return jsonify({"message": "Code must be exactly 6 characters long."}), 400
 
-        # Find the league and add the user_id to the members array if not already present
-        result = leagues_collection.update_one(
-            # Criteria: match code, is private, and user is NOT already in members
-            {"code": code, "is_private": True, "members": {"$ne": user_id}}, 
-            # Action: Add user_id to members set (safe for no duplicates)
-            {"$addToSet": {"members": user_id}} 
-        )
-        
-        # If no documents were modified, check why (already a member or not found)
-        if result.modified_count == 0:
-            league = leagues_collection.find_one({"code": code, "is_private": True})
-            if league:
-                if user_id in league.get('members', []):
-                    return jsonify({"message": "You are already a member of this league."}), 200
-                else:
-                    return jsonify({"message": "League not found or not private."}), 404
-            else:
-                 return jsonify({"message": "League not found or not private."}), 404
+        league = leagues_collection.find_one({"code": code, "is_private": True}, {"_id": 1})
+        if not league:
+            return jsonify({"message": "League not found or not private."}), 404
 
+        # The unique (league_id, telegram_id) index makes the join idempotent
+        if not league_members.add_member(db, league['_id'], user_id):
+            return jsonify({"message": "You are already a member of this league."}), 200
 
-        return jsonify({"message": "Successfully joined the league!", "members_added": result.modified_count}), 200
+        return jsonify({"message": "Successfully joined the league!", "members_added": 1}), 200
 
     except Exception as e:
         print(f"Error during league join confirmation: {e}")
         return jsonify({"message": f"An unexpected error occurred during joining: {e}"}), 500
 
 
+@app.route('/api/leagues/leave', methods=['POST'])
+@user_required
+def leave_league(user_id):
+    """Removes the user from a league, identified by league_id."""
+    try:
+        data = request.get_json(silent=True) or {}
+        league_id = data.get('league_id', '')
+        if not ObjectId.is_valid(league_id):
+            return jsonify({"message": "A valid league_id must be provided."}), 400
+
+        if not league_members.remove_member(db, ObjectId(league_id), user_id):
+            return jsonify({"message": "You are not a member of this league."}), 404
+
+        return jsonify({"message": "Successfully left the league."}), 200
+
+    except Exception as e:
+        print(f"Error during league leave: {e}")
+        return jsonify({"message": f"An unexpected error occurred while leaving the league: {e}"}), 500
+
+
+@app.route('/api/leagues/<league_id>/leaderboard', methods=['GET'])
+def league_leaderboard(league_id):
+    """Returns a league's total points and its members ranked by points scored since joining."""
+    try:
+        if not ObjectId.is_valid(league_id):
+            return jsonify({"message": "Invalid league id."}), 400
+        limit = max(1, min(int(request.args.get('limit', 50)), LEADERBOARD_MAX_LIMIT))
+
+        league = db.leagues.find_one({"_id": ObjectId(league_id)}, {"name": 1, "points": 1, "member_count": 1})
+        if not league:
+            return jsonify({"message": "League not found."}), 404
+
+        rows = league_members.league_leaderboard(db, league['_id'], limit)
+        ids = [r['telegram_id'] for r in rows]
+        profiles = {}
+        if ids:
+            cursor = db.users.find({'telegram_id': {'$in': ids}}, {'_id': 0, 'telegram_id': 1, 'username': 1, 'first_name': 1, 'avatar_url': 1})
+            profiles = {u['telegram_id']: u for u in cursor}
+
+        leaderboard = []
+        for rank, row in enumerate(rows, start=1):
+            u = profiles.get(row['telegram_id'], {})
+            leaderboard.append({
+                'id': row['telegram_id'],
+                'userName': u.get('username') or u.get('first_name') or f"user_{row['telegram_id']}",
+                'gamePoints': int(row.get('points') or 0),
+                'currentRank': rank,
+                'avatarUrl': u.get('avatar_url') or ''
+            })
+
+        return jsonify({
+            "league_id": league_id,
+            "name": league.get('name'),
+            "points": league.get('points', 0),
+            "member_count": league.get('member_count', 0),
+            "leaderboard": leaderboard
+        }), 200
+    except ValueError:
+        return jsonify({"message": "limit must be an integer."}), 400
+    except Exception as e:
+        print(f"Error fetching league leaderboard: {e}")
+        return jsonify({"message": "Error fetching league leaderboard."}), 500
+
+
 # --- Telegram Authentication Endpoint ---
+def _auth_response(profile, verified):
+    """Login response: the profile, plus a signed session token for user_required
+    routes when Telegram's init_data signature was verified. Unverified logins
+    (no bot token configured) get no token; they can only use the legacy user id.
+    """
+    response = {'message': 'Authentication successful', 'user': profile}
+    if verified:
+        token, expires_at = session_tokens.issue(profile['telegram_id'])
+        response['token'] = token
+        response['token_expires_at'] = expires_at
+    return jsonify(response), 200
+
+
 @app.route('/api/auth/telegram', methods=['POST'])
 def auth_telegram():
     """Verify Telegram WebApp init data and create/update a user in MongoDB.
 
     Expected JSON body: { "init_data": "key1=value1&key2=value2..." }
-    Or: { "user": { ... } } (initDataUnsafe payload) - verification skipped only if TELEGRAM_BOT_TOKEN missing
+    Or: { "user": { ... } } (initDataUnsafe payload) - only accepted while TELEGRAM_BOT_TOKEN is missing
+    A session token is only issued when init_data passed the HMAC check and its
+    auth_date is within TELEGRAM_AUTH_MAX_AGE.
     """
-    users = db.users
     data = request.get_json() or {}
 
-    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-
     # If client provided full init_data string, parse it
     init_data_str = data.get('init_data')
     user_obj = data.get('user')
 
-    parsed = {}
+    cache_key = None
+    cache_ttl = None
     if init_data_str:
-        # Parse query-string like input
+        # A reload with the same init_data inside the auth window was already verified and upserted
+        cache_key = hashlib.sha256(init_data_str.encode()).digest()
+        cached_profile = auth_cache.get(cache_key)
+        if cached_profile is not None:
+            # Only init_data logins are cached, and with a bot token set they passed the HMAC check
+            return _auth_response(cached_profile, TELEGRAM_SECRET_KEY is not None)
+
+        # Parse query-string like input; Telegram signs the URL-decoded values
         try:
-            pairs = [p for p in init_data_str.split('&') if p]
-            for p in pairs:
-                k, v = p.split('=', 1)
-                parsed[k] = v
-        except Exception:
+            parsed = dict(parse_qsl(init_data_str, keep_blank_values=True, strict_parsing=True))
+        except ValueError:
             return jsonify({'message': 'Invalid init_data format.'}), 400
 
         provided_hash = parsed.pop('hash', None)
-        if bot_token:
+        if TELEGRAM_SECRET_KEY:
             # Verify per Telegram docs
+            data_check_string = '\n'.join(f"{key}={parsed[key]}" for key in sorted(parsed))
+            hmac_hash = hmac.new(TELEGRAM_SECRET_KEY, data_check_string.encode(), hashlib.sha256).hexdigest()
+            if not provided_hash or not hmac.compare_digest(hmac_hash, provided_hash):
+                return jsonify({'message': 'Telegram init data verification failed.'}), 401
             try:
-                import hashlib, hmac
-                data_check_arr = []
-                for key in sorted(parsed.keys()):
-                    data_check_arr.append(f"{key}={parsed[key]}")
-                data_check_string = '\n'.join(data_check_arr)
-                secret_key = hashlib.sha256(bot_token.encode()).digest()
-                hmac_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
-                if not provided_hash or hmac_hash != provided_hash:
-                    return jsonify({'message': 'Telegram init data verification failed.'}), 401
-            except Exception as ex:
-                print('Telegram verification error:', ex)
-                return jsonify({'message': 'Telegram verification error.'}), 500
-        # Map parsed to a user object
-        user_obj = parsed.get('user') if parsed.get('user') else {
-            'id': parsed.get('id'),
-            'first_name': parsed.get('first_name'),
-            'last_name': parsed.get('last_name'),
-            'username': parsed.get('username')
-        }
+                auth_age = time.time() - int(parsed.get('auth_date', ''))
+            except ValueError:
+                return jsonify({'message': 'Telegram init data has no valid auth_date.'}), 401
+            if auth_age > TELEGRAM_AUTH_MAX_AGE:
+                return jsonify({'message': 'Telegram init data has expired. Please reopen the app.'}), 401
+            cache_ttl = min(auth_cache.ttl, TELEGRAM_AUTH_MAX_AGE - auth_age)
+        # Map parsed to a user object (WebApp init data carries it as a JSON string)
+        try:
+            user_obj = json.loads(parsed['user']) if parsed.get('user') else {
+                'id': parsed.get('id'),
+                'first_name': parsed.get('first_name'),
+                'last_name': parsed.get('last_name'),
+                'username': parsed.get('username')
+            }
+        except ValueError:
+            return jsonify({'message': 'Invalid user in init_data.'}), 400
+        if not isinstance(user_obj, dict):
+            return jsonify({'message': 'Invalid user in init_data.'}), 400
+    elif user_obj and TELEGRAM_SECRET_KEY:
+        # An unsigned initDataUnsafe payload proves nothing once verification is possible
+        return jsonify({'message': 'Signed init_data is required for Telegram authentication.'}), 401
 
     if not user_obj:
         return jsonify({'message': 'Missing user data for Telegram authentication.'}), 400
 
     # Normalize id
-    tg_id = str(user_obj.get('id') or user_obj.get('user_id') or user_obj.get('userId'))
-    if not tg_id:
+    raw_id = user_obj.get('id') or user_obj.get('user_id') or user_obj.get('userId')
+    if not raw_id:
         return jsonify({'message': 'Telegram user id missing.'}), 400
+    tg_id = str(raw_id)
 
-    # Upsert user document
+    # Upsert user document in a single round-trip; scores are only initialized on insert
     try:
         now = datetime.utcnow()
         user_doc = {
@@ -450,18 +1017,25 @@ def auth_telegram():
             'username': user_obj.get('username') or user_obj.get('user_name') or '',
             'updated_at': now,
         }
+        update = {'$set': user_doc, '$setOnInsert': {'overall_score': 0, 'created_at': now}}
+        try:
+            profile = db.users.find_one_and_update(
+                {'telegram_id': tg_id}, update, projection={'_id': 0},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent login inserted the user first; retry as a plain update
+            profile = db.users.find_one_and_update(
+                {'telegram_id': tg_id}, update, projection={'_id': 0},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
 
-        # Initialize scores if new
-        existing = users.find_one({'telegram_id': tg_id})
-        if not existing:
-            user_doc.update({'overall_score': 0, 'created_at': now})
-            users.insert_one(user_doc)
-        else:
-            users.update_one({'telegram_id': tg_id}, {'$set': user_doc})
-
-        # Return lightweight profile
-        profile = users.find_one({'telegram_id': tg_id}, {'_id': 0})
-        return jsonify({'message': 'Authentication successful', 'user': profile}), 200
+        # Only seed unknown users: the engine may be ahead of Mongo while score writes are queued
+        if tg_id not in rank_engine:
+            rank_engine.update(tg_id, profile.get('overall_score', 0))
+        if cache_key is not None:
+            auth_cache.set(cache_key, profile, ttl=cache_ttl)
+        return _auth_response(profile, init_data_str is not None and TELEGRAM_SECRET_KEY is not None)
     except Exception as ex:
         print('Error creating/updating user:', ex)
         return jsonify({'message': 'Internal server error while creating user.'}), 500
@@ -471,7 +1045,11 @@ def auth_telegram():
 @app.route('/api/score/submit', methods=['POST'])
 @user_required
 def submit_score(user_id):
-    """Submit quiz results and update user's overall score and leaderboard."""
+    """
+    Submit quiz results. overall_score is incremented in Mongo and returned as
+    stored; the result row, league totals and window rollups are queued for a
+    batched write-behind flush. The rank comes from the in-process rank engine.
+    """
     try:
         body = request.get_json() or {}
         points = int(body.get('points', 0))
@@ -479,11 +1057,17 @@ def submit_score(user_id):
         answered = int(body.get('answered', 0))
         quiz_id = body.get('quiz_id')
 
-        users = db.users
-        results = db.results
-
         now = datetime.utcnow()
-        # Record the result
+        # overall_score is updated synchronously so every worker returns the stored total
+        profile = db.users.find_one_and_update(
+            {'telegram_id': str(user_id)},
+            {'$inc': {'overall_score': points}, '$set': {'updated_at': now}},
+            projection={'_id': 0, 'overall_score': 1},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        overall = int(profile.get('overall_score') or 0)
+
+        # The result row, league totals and window rollups are written by the ingest queue
         res_doc = {
             'telegram_id': str(user_id),
             'quiz_id': quiz_id,
@@ -492,17 +1076,13 @@ def submit_score(user_id):
             'answered': answered,
             'timestamp': now
         }
-        results.insert_one(res_doc)
-
-        # Update user's overall score
-        users.update_one({'telegram_id': str(user_id)}, {'$inc': {'overall_score': points}, '$set': {'updated_at': now}}, upsert=True)
-
-        user = users.find_one({'telegram_id': str(user_id)})
-        overall = user.get('overall_score', 0)
+        score_queue.submit(res_doc)
 
-        # Compute simple rank (1-based) - count users with higher score + 1
-        higher_count = users.count_documents({'overall_score': {'$gt': overall}})
-        rank = higher_count + 1
+        # Rank (1-based) comes from the in-process rank engine - users with higher score + 1.
+        # It is optimistic: other workers' recent submissions arrive with the next sync.
+        rank_engine.update(user_id, overall)
+        rank = rank_engine.rank(user_id)
+        window_ranks.increment(user_id, points, now)
 
         return jsonify({'message': 'Score submitted', 'overall_score': overall, 'rank': rank}), 200
     except Exception as e:
@@ -510,29 +1090,129 @@ def submit_score(user_id):
         return jsonify({'message': 'Error submitting score.'}), 500
 
 
+LEADERBOARD_MAX_LIMIT = 200
+LEADERBOARD_MAX_RADIUS = 50
+LEADERBOARD_PROJECTION = {'_id': 0, 'telegram_id': 1, 'username': 1, 'first_name': 1, 'overall_score': 1, 'avatar_url': 1}
+PROFILE_PROJECTION = {'_id': 0, 'telegram_id': 1, 'username': 1, 'first_name': 1, 'avatar_url': 1}
+
+
+def _leaderboard_sort(score_field, reverse=False):
+    """Leaderboard order: score desc, telegram_id asc (matches the compound indexes and the rank engines)."""
+    if reverse:
+        return [(score_field, 1), ('telegram_id', -1)]
+    return [(score_field, -1), ('telegram_id', 1)]
+
+
+def _after_cursor_query(score, telegram_id, score_field='overall_score'):
+    """Keyset filter for rows strictly after (score, telegram_id) in leaderboard order."""
+    return {'$or': [
+        {score_field: {'$lt': score}},
+        {score_field: score, 'telegram_id': {'$gt': telegram_id}}
+    ]}
+
+
+def _before_cursor_query(score, telegram_id, score_field='overall_score'):
+    """Keyset filter for rows strictly before (score, telegram_id) in leaderboard order."""
+    return {'$or': [
+        {score_field: {'$gt': score}},
+        {score_field: score, 'telegram_id': {'$lt': telegram_id}}
+    ]}
+
+
+def _leaderboard_entry(u, score, rank, snapshot):
+    member = str(u.get('telegram_id'))
+    return {
+        'id': member,
+        'userName': u.get('username') or u.get('first_name') or f"user_{member}",
+        'gamePoints': int(score or 0),
+        'currentRank': rank,
+        'previousRank': snapshot.rank(member) if snapshot is not None else None,
+        'avatarUrl': u.get('avatar_url') or ''
+    }
+
+
+def _leaderboard_page(collection, base_filter, score_field, projection, engine, limit):
+    """
+    Reads one leaderboard page in the mode selected by the request args and
+    returns (rows, start), where start is the 0-based position of the first
+    row. Returns (None, 0) when the `around` user is not on the board.
+    """
+    around = request.args.get('around')
+    after_score = request.args.get('after_score')
+    after_id = request.args.get('after_id')
+
+    def find(extra, reverse, count):
+        query = dict(base_filter, **extra) if extra else base_filter
+        return list(collection.find(query, projection).sort(_leaderboard_sort(score_field, reverse)).limit(count))
+
+    if around:
+        radius = max(0, min(int(request.args.get('radius', 5)), LEADERBOARD_MAX_RADIUS))
+        target = collection.find_one(dict(base_filter, telegram_id=str(around)), projection)
+        if not target:
+            return None, 0
+        score = int(target.get(score_field) or 0)
+        tg_id = str(target['telegram_id'])
+        above = find(_before_cursor_query(score, tg_id, score_field), True, radius) if radius else []
+        below = find(_after_cursor_query(score, tg_id, score_field), False, radius) if radius else []
+        above.reverse()
+        if tg_id not in engine:
+            engine.update(tg_id, score)
+        return above + [target] + below, engine.position(tg_id) - len(above)
+
+    if after_score is not None and after_id is not None:
+        score = int(after_score)
+        rows = find(_after_cursor_query(score, str(after_id), score_field), False, limit)
+        return rows, engine.position_after(score, str(after_id))
+
+    return find(None, False, limit), 0
+
+
 @app.route('/api/leaderboard/global', methods=['GET'])
 def global_leaderboard():
-    """Return top users by overall_score."""
+    """Return users by overall_score, or by points within a time window.
+
+    Modes:
+    - default: top `limit` users.
+    - keyset page: `after_score` + `after_id` (the gamePoints/id of the last row
+      of the previous page) returns the next `limit` users.
+    - rank window: `around=<telegram_id>` returns up to `radius` users above and
+      below that user, with the user in the middle.
+
+    `window=day|week|season` switches from all-time overall_score to the
+    current bucket of the score rollups; all modes work the same way.
+
+    Rows come from an index walk on (score desc, telegram_id), so no page costs
+    more than its own size; rank numbers are offset from the rank engine
+    position of the first row. previousRank is looked up in the last rank
+    snapshot (null for users who joined after it was taken, and for windows).
+    """
     try:
-        limit = int(request.args.get('limit', 50))
-        users = db.users
-        cursor = users.find({}, {'_id': 0, 'telegram_id': 1, 'username': 1, 'first_name': 1, 'overall_score': 1}).sort('overall_score', -1).limit(limit)
+        limit = max(1, min(int(request.args.get('limit', 50)), LEADERBOARD_MAX_LIMIT))
+        window = request.args.get('window')
+
+        if window:
+            if window not in score_rollups.WINDOWS:
+                return jsonify({'message': 'window must be one of day, week or season.'}), 400
+            bucket, engine = window_ranks.engine(window)
+            rows, start = _leaderboard_page(
+                db.score_rollups, {'window': window, 'bucket': bucket}, 'points',
+                {'_id': 0, 'telegram_id': 1, 'points': 1}, engine, limit
+            )
+            score_field, snapshot = 'points', None
+            if rows:
+                profiles = {u['telegram_id']: u for u in db.users.find({'telegram_id': {'$in': [r['telegram_id'] for r in rows]}}, PROFILE_PROJECTION)}
+                rows = [dict(profiles.get(r['telegram_id'], {}), **r) for r in rows]
+        else:
+            rows, start = _leaderboard_page(db.users, {}, 'overall_score', LEADERBOARD_PROJECTION, rank_engine, limit)
+            score_field, snapshot = 'overall_score', rank_snapshot
 
-        leaderboard = []
-        rank = 1
-        for u in cursor:
-            display_name = u.get('username') or u.get('first_name') or f"user_{u.get('telegram_id')}"
-            leaderboard.append({
-                'id': str(u.get('telegram_id')),
-                'userName': display_name,
-                'gamePoints': int(u.get('overall_score') or 0),
-                'currentRank': rank,
-                'previousRank': None,
-                'avatarUrl': u.get('avatar_url') or ''
-            })
-            rank += 1
+        if rows is None:
+            return jsonify({'message': 'User not found on leaderboard.'}), 404
 
+        leaderboard = [_leaderboard_entry(u, u.get(score_field), start + i + 1, snapshot) for i, u in enumerate(rows)]
         return jsonify(leaderboard), 200
+    except ValueError:
+        return jsonify({'message': 'limit, radius and after_score must be integers.'}), 400
     except Exception as e:
         print('Error fetching leaderboard:', e)
         return jsonify({'message': 'Error fetching leaderboard.'}), 500
@@ -540,20 +1220,16 @@ def global_leaderboard():
 
 @app.route('/api/leagues/my', methods=['GET'])
 def my_leagues():
-    """Return leagues where the requesting user is a member. Accepts user_id via header/body/query."""
+    """Return leagues where the requesting user is a member. Accepts a session token or legacy user_id."""
     # Use same resolution as user_required
-    uid = request.headers.get('X-USER-ID') or request.args.get('user_id')
-    if not uid:
-        try:
-            uid = (request.get_json(silent=True) or {}).get('user_id')
-        except Exception:
-            uid = None
+    uid, error = resolve_user_id()
     if not uid:
-        return jsonify({'message': 'Missing user_id'}), 400
+        return jsonify({'message': error}), 400
 
     try:
         leagues = db.leagues
-        cursor = leagues.find({'members': uid})
+        league_ids = league_members.league_ids_for_user(db, uid)
+        cursor = leagues.find({'_id': {'$in': league_ids}}, {'name': 1, 'description': 1, 'creator_id': 1, 'member_count': 1, 'points': 1}) if league_ids else []
         out = []
         for l in cursor:
             out.append({
@@ -561,7 +1237,7 @@ def my_leagues():
                 'name': l.get('name'),
                 'description': l.get('description'),
                 'isOwner': l.get('creator_id') == uid,
-                'members': len(l.get('members', [])),
+                'members': l.get('member_count', 0),
                 'points': l.get('points', 0)
             })
         return jsonify(out), 200
@@ -569,7 +1245,94 @@ def my_leagues():
         print('Error fetching my leagues:', e)
         return jsonify({'message': 'Error fetching my leagues.'}), 500
 
+@app.route('/api/batch', methods=['POST'])
+def batch_requests():
+    """Runs up to BATCH_MAX_ITEMS API calls in one exchange (see batch.py).
+
+    Expected JSON body: { "requests": [{ "id", "method", "path", "body", "headers" }, ...] }
+    The caller's Authorization / X-USER-ID / X-API-KEY headers apply to every
+    item. Returns 200 with one { "id", "status", "body" } result per item, in
+    request order; each item carries its own status code. Streaming routes
+    (the results export) cannot be batched.
+    """
+    try:
+        items = parse_items(request.get_json(silent=True), BATCH_MAX_ITEMS, streamed_paths=BATCH_STREAMED_PATHS)
+    except BatchError as e:
+        return jsonify({"message": e.message, "index": e.index}), 400
+
+    headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+    try:
+        body, encoding = encode_results(batch_runner.run(items, headers, request.remote_addr), request.accept_encodings['gzip'])
+        response = make_response(body, 200)
+        response.mimetype = 'application/json'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+    except Exception as e:
+        print(f"Error running batch: {e}")
+        return jsonify({"message": "Error running batch."}), 500
+
+RESULTS_MAX_LIMIT = 100
+
+
+@app.route('/api/users/<telegram_id>/results', methods=['GET'])
+@user_required
+def user_results(user_id, telegram_id):
+    """Return a user's quiz results, newest first, plus per-quiz aggregates.
+
+    Users can only read their own history. Pages are keyset-paginated: pass the
+    `next` cursor of the previous page back as `before_timestamp` + `before_id`.
+    The per-quiz aggregates are only computed for the first page. Results still
+    waiting in the score ingest queue show up after its next flush.
+    """
+    if str(user_id) != str(telegram_id):
+        return jsonify({'message': 'You can only view your own results.'}), 403
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), RESULTS_MAX_LIMIT))
+        cursor = None
+        if request.args.get('before_timestamp') or request.args.get('before_id'):
+            cursor = results_history.parse_cursor(request.args.get('before_timestamp', ''), request.args.get('before_id', ''))
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer and before_timestamp/before_id a cursor from a previous page.'}), 400
+
+    try:
+        rows, next_cursor = results_history.history_page(db.results, telegram_id, limit, cursor)
+        response = {
+            'results': [results_history.serialize_result(r) for r in rows],
+            'next': {'before_timestamp': next_cursor[0].isoformat(), 'before_id': str(next_cursor[1])} if next_cursor else None
+        }
+        if cursor is None:
+            response['quizzes'] = results_history.quiz_aggregates(db.results, telegram_id)
+        return jsonify(response), 200
+    except Exception as e:
+        print('Error fetching user results:', e)
+        return jsonify({'message': 'Error fetching results.'}), 500
+
+
+@app.route('/api/admin/results/export', methods=['GET'])
+@admin_required
+def export_results():
+    """Streams the results collection as NDJSON in _id order.
+
+    Optional filters: `telegram_id`, and `after_id` to resume an interrupted
+    export from the last _id received.
+    """
+    query = {}
+    if request.args.get('telegram_id'):
+        query['telegram_id'] = request.args.get('telegram_id')
+    if request.args.get('after_id'):
+        if not ObjectId.is_valid(request.args.get('after_id')):
+            return jsonify({'message': 'after_id is not a valid id.'}), 400
+        query['_id'] = {'$gt': ObjectId(request.args.get('after_id'))}
+    batch_size = int(os.environ.get("RESULTS_EXPORT_BATCH_SIZE", 1000))
+
+    response = Response(stream_with_context(results_history.iter_ndjson_export(db.results, query, batch_size)), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=results.ndjson'
+    return response
+
 # --- Server Start ---
+# Development server. In production run `gunicorn -c gunicorn.conf.py`.
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    create_app().run(debug=True, port=5000)
  
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""Tiny helper for periodic background jobs.
+
+Jobs run on daemon threads so they never block interpreter shutdown. Each
+tick is wrapped in a try/except: a failing job logs and tries again on the
+next interval instead of killing its thread.
+"""
+import threading
+
+
+class PeriodicTask:
+    """Runs fn every interval seconds on a daemon thread until stopped."""
+
+    def __init__(self, name, interval, fn, run_immediately=False):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.run_immediately = run_immediately
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        if self.run_immediately:
+            self._tick()
+        while not self._stop.wait(self.interval):
+            self._tick()
+
+    def _tick(self):
+        try:
+            self.fn()
+        except Exception as e:
+            print(f"Background task '{self.name}' failed: {e}")
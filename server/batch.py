@@ -0,0 +1,151 @@
+"""Several API calls in one HTTP exchange, for POST /api/batch.
+
+The mini-app's cold start is a burst of independent calls (questions, my
+leagues, the leaderboard, ...). On a mobile link each of those is a full round
+trip, so the client can send them as one list instead:
+
+    {"requests": [{"id": "lb", "method": "GET", "path": "/api/leaderboard/global?limit=20"},
+                  {"id": "mine", "method": "GET", "path": "/api/leagues/my"}]}
+
+Every item is dispatched to the existing route through the normal Flask
+request cycle (decorators, hooks, rate limits and metrics included) with the
+caller's auth headers and address. GET items run concurrently on a thread
+pool; the other items change state, so they run one at a time in list order
+on a single pool thread.
+Items are independent: a read is not ordered against the writes of the same
+batch, and no item sees another's response.
+
+JSON item bodies are spliced into the batch response as the bytes the route
+produced (e.g. the pre-serialized question bank), never parsed and
+re-encoded. Items are dispatched without Accept-Encoding so those bytes are
+plain JSON; the batch response as a whole is compressed instead. Routes that
+stream their response cannot be batched.
+"""
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_ITEMS = 20
+METHODS = ('GET', 'POST')
+# Caller headers passed on to every item; items may override them
+FORWARDED_HEADERS = ('Authorization', 'X-USER-ID', 'X-API-KEY')
+# Client-address headers items may not set: the caller's resolved address is
+# passed as REMOTE_ADDR, so per-IP limits cannot be dodged per item
+ADDRESS_HEADERS = ('x-forwarded-for', 'x-real-ip', 'forwarded')
+# Item headers dropped: client addresses, and encodings (item bodies must be plain JSON to splice)
+IGNORED_HEADERS = ADDRESS_HEADERS + ('accept-encoding',)
+# Batch responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+
+class BatchError(Exception):
+    """Raised for a batch payload that must be rejected as a whole."""
+
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.message = message
+        self.index = index
+
+
+def parse_items(payload, max_items=MAX_ITEMS, streamed_paths=()):
+    """Validates the request body and returns the normalized item list.
+
+    streamed_paths lists routes whose responses stream; items for them are rejected.
+    """
+    items = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchError('Expected a JSON object with a non-empty "requests" list.')
+    if len(items) > max_items:
+        raise BatchError(f'A batch may contain at most {max_items} requests.')
+
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise BatchError('Each request must be a JSON object.', index)
+        method = str(item.get('method', 'GET')).upper()
+        path = item.get('path')
+        if method not in METHODS:
+            raise BatchError(f'method must be one of {", ".join(METHODS)}.', index)
+        if not isinstance(path, str) or not path.startswith('/api/'):
+            raise BatchError('path must be an /api/ route.', index)
+        route = path.split('?', 1)[0].rstrip('/')
+        if route == '/api/batch':
+            raise BatchError('Batches cannot be nested.', index)
+        if route in streamed_paths:
+            raise BatchError(f'{route} streams its response and cannot be batched.', index)
+        headers = item.get('headers') or {}
+        if not isinstance(headers, dict):
+            raise BatchError('headers must be a JSON object.', index)
+        parsed.append({
+            'id': item.get('id', index),
+            'method': method,
+            'path': path,
+            'body': item.get('body'),
+            'headers': {str(k): str(v) for k, v in headers.items() if str(k).lower() not in IGNORED_HEADERS},
+        })
+    return parsed
+
+
+def _item(item_id, status, body=None, raw_body=None):
+    """One item result as JSON bytes; raw_body is already-serialized JSON spliced in as is."""
+    if raw_body is None:
+        raw_body = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    head = json.dumps({'id': item_id, 'status': status}, separators=(',', ':')).encode('utf-8')
+    return head[:-1] + b',"body":' + raw_body + b'}'
+
+
+def encode_results(results, accept_gzip=False):
+    """Joins item results into the batch body. Returns (body, content_encoding or None)."""
+    body = b'{"results":[' + b','.join(results) + b']}'
+    if accept_gzip and len(body) >= COMPRESS_MIN_BYTES:
+        return gzip.compress(body, compresslevel=1), 'gzip'
+    return body, None
+
+
+class BatchRunner:
+    """Dispatches batch items against a Flask app on a shared thread pool."""
+
+    def __init__(self, app, max_workers=8):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+
+    def _dispatch(self, item, headers, remote_addr):
+        headers = dict(headers, **item['headers'])
+        options = {'method': item['method'], 'headers': headers}
+        if remote_addr:
+            # Per-IP rate limits apply to the caller, not to the loopback test request
+            options['environ_base'] = {'REMOTE_ADDR': remote_addr}
+        if item['body'] is not None:
+            options['json'] = item['body']
+        try:
+            with self.app.test_request_context(item['path'], **options):
+                response = self.app.make_response(self.app.full_dispatch_request())
+                status = response.status_code
+                body = response.get_data()
+        except Exception as e:
+            print(f"Error in batch item {item['id']} ({item['method']} {item['path']}): {e}")
+            return _item(item['id'], 500, {'message': 'Error processing batch item.'})
+
+        if response.mimetype == 'application/json' and body and 'Content-Encoding' not in response.headers:
+            return _item(item['id'], status, raw_body=body.strip())
+        return _item(item['id'], status, body.decode('utf-8', 'replace') if body else None)
+
+    def _dispatch_in_order(self, items, headers, remote_addr):
+        return [self._dispatch(item, headers, remote_addr) for item in items]
+
+    def run(self, items, headers, remote_addr=None):
+        """Runs the items and returns one result (JSON bytes, see encode_results) per item, in request order."""
+        reads = [(i, self.executor.submit(self._dispatch, item, headers, remote_addr)) for i, item in enumerate(items) if item['method'] == 'GET']
+        write_slots = [i for i, item in enumerate(items) if item['method'] != 'GET']
+        writes = self.executor.submit(self._dispatch_in_order, [items[i] for i in write_slots], headers, remote_addr) if write_slots else None
+
+        results = [None] * len(items)
+        for i, future in reads:
+            results[i] = future.result()
+        if writes is not None:
+            for i, result in zip(write_slots, writes.result()):
+                results[i] = result
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,478 @@
+"""Offline load test for the API against an in-process Mongo stand-in.
+
+Seeds a synthetic dataset (by default 1M users, 100k leagues with Zipf-skewed
+membership and a 50k-question bank), starts the app with create_app() and
+replays a weighted mix of the mini-app's routes through Flask test clients on
+a pool of threads. The report is JSON: throughput plus p50/p95/p99 latency per
+endpoint, so two runs can be diffed (or compared directly with --baseline).
+
+    python benchmark.py --scale 0.01 --requests 5000 --concurrency 8
+    python benchmark.py --mongo-uri mongodb://localhost:27017 --drop --output run.json
+    python benchmark.py --scale 0.01 --baseline run.json
+
+Without --mongo-uri the app runs against mongomock, which measures the
+app's own overhead (routing, engines, serialization) rather than the
+database; point --mongo-uri at a throwaway mongod for numbers that include
+real query plans. The app always uses that server's quiz_database, which the
+run drops before seeding and again at the end, so --mongo-uri also needs
+--drop to confirm it. Nothing is written to
+the production spill file.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from itertools import accumulate
+
+DB_NAME = 'quiz_database'
+SEED_BATCH = 10000
+CATEGORIES = ['science', 'history', 'geography', 'sports', 'music', 'movies', 'literature', 'art', 'technology', 'nature']
+DIFFICULTIES = ['easy', 'medium', 'hard']
+WORDS = ['alpha', 'brave', 'cosmic', 'delta', 'eagle', 'falcon', 'giant', 'harbor', 'iron', 'jungle', 'knight',
+         'lunar', 'mighty', 'nova', 'ocean', 'polar', 'quantum', 'rapid', 'solar', 'thunder', 'ultra', 'vortex',
+         'wild', 'xenon', 'young', 'zenith', 'quiz', 'league', 'masters', 'club', 'crew', 'squad']
+
+# Weighted route mix, roughly what the mini-app sends: a login and question
+# fetch per session, then mostly score submits and leaderboard views.
+ROUTE_MIX = {
+    'auth_telegram': 5,
+    'get_questions': 5,
+    'sample_questions': 10,
+    'submit_score': 25,
+    'global_leaderboard': 20,
+    'global_leaderboard?around': 8,
+    'global_leaderboard?window': 5,
+    'my_leagues': 10,
+    'league_search': 7,
+    'league_leaderboard': 4,
+    'get_status': 1,
+}
+
+
+# --- Backend ---
+
+def use_mongomock():
+    """Routes pymongo.MongoClient to one shared mongomock store.
+
+    Also papers over the mongomock gaps the app hits: the `sort` keyword
+    newer pymongo versions put on UpdateOne, create_indexes() dropping
+    partialFilterExpression (which breaks the unique index on league codes),
+    and find() mutating the projection dict it is given (the app shares
+    module-level projections between threads).
+    """
+    import mongomock
+    import mongomock.collection
+    import mongomock.store
+    import pymongo
+
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def _add_update(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+
+    def _create_indexes(self, models, **kwargs):
+        names = []
+        for model in models:
+            spec = dict(model.document)
+            keys = list(spec.pop('key').items())
+            if spec['name'] in self._store.indexes:
+                # mongomock re-checks uniqueness on every call, ignoring the partial filter
+                names.append(spec['name'])
+                continue
+            names.append(self.create_index(keys, **spec))
+        return names
+
+    find = mongomock.collection.Collection.find
+
+    def _find(self, filter=None, projection=None, *args, **kwargs):
+        return find(self, filter, dict(projection) if isinstance(projection, dict) else projection, *args, **kwargs)
+
+    store = mongomock.store.ServerStore()
+
+    class SharedMongoClient(mongomock.MongoClient):
+        def __init__(self, host=None, **kwargs):
+            # Pool options and event listeners have no meaning for mongomock
+            super().__init__(host, _store=store)
+
+    mongomock.collection.BulkOperationBuilder.add_update = _add_update
+    mongomock.collection.Collection.create_indexes = _create_indexes
+    mongomock.collection.Collection.find = _find
+    pymongo.MongoClient = SharedMongoClient
+    return SharedMongoClient
+
+
+# --- Synthetic data ---
+
+def _batched(docs, collection):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= SEED_BATCH:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def zipf_weights(n, s):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def seed_dataset(db, users, leagues, questions, memberships_per_user, skew, rng):
+    """Inserts the synthetic dataset and returns the ids the request mix draws from."""
+    from bson.objectid import ObjectId
+    import indexes
+
+    # Same indexes the app creates at startup, so inserts pay the unique checks up front
+    for collection_name, error in indexes.ensure_indexes(db).items():
+        print(f"Error creating indexes on {collection_name}: {error}", file=sys.stderr)
+
+    # Heavy-tailed scores: most players have a few hundred points, a few have a lot
+    scores = [int(rng.paretovariate(1.2) * 100) for _ in range(users)]
+    now = time.time()
+    _batched(({
+        'telegram_id': str(i + 1),
+        'username': f'user{i + 1}',
+        'first_name': rng.choice(WORDS).title(),
+        'last_name': '',
+        'overall_score': scores[i],
+    } for i in range(users)), db.users)
+
+    league_ids = [ObjectId() for _ in range(leagues)]
+    league_names = [f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}' for i in range(leagues)]
+
+    # Membership sizes follow a Zipf curve over leagues: a few huge leagues, a long tail of small ones
+    members = {}
+    member_count = [0] * leagues
+    league_points = [0] * leagues
+    cum_weights = list(accumulate(zipf_weights(leagues, skew)))
+    total = cum_weights[-1]
+    for _ in range(int(users * memberships_per_user)):
+        slot = bisect_left(cum_weights, rng.random() * total)
+        user = rng.randrange(users)
+        if (slot, user) in members:
+            continue
+        points = rng.randrange(0, scores[user] + 1)
+        members[(slot, user)] = points
+        member_count[slot] += 1
+        league_points[slot] += points
+
+    _batched(({
+        '_id': league_ids[i],
+        'name': league_names[i],
+        'description': f'{rng.choice(WORDS)} {rng.choice(WORDS)} players',
+        'creator_id': str(rng.randrange(users) + 1),
+        'is_private': False,
+        'code': None,
+        'member_count': member_count[i],
+        'points': league_points[i],
+    } for i in range(leagues)), db.leagues)
+    _batched(({
+        'league_id': league_ids[slot],
+        'telegram_id': str(user + 1),
+        'points': points,
+    } for (slot, user), points in members.items()), db.league_members)
+
+    _batched(({
+        'question': f'Question {i}: which {rng.choice(WORDS)} is the most {rng.choice(WORDS)}?',
+        'options': [rng.choice(WORDS) for _ in range(4)],
+        'answer': rng.randrange(4),
+        'category': rng.choice(CATEGORIES),
+        'difficulty': rng.choice(DIFFICULTIES),
+    } for i in range(questions)), db.questions)
+
+    return {
+        'users': users,
+        'league_ids': [str(l) for l in league_ids],
+        'league_cum_weights': cum_weights,
+        'seed_seconds': time.time() - now,
+        'memberships': len(members),
+    }
+
+
+# --- Request mix ---
+
+class Workload:
+    """Builds requests for each entry of the route mix from the seeded ids."""
+
+    def __init__(self, dataset, tokens, mix):
+        self.dataset = dataset
+        self.tokens = tokens
+        self.names = list(mix)
+        self.cum_weights = list(accumulate(mix.values()))
+
+    def user(self, rng):
+        return str(rng.randrange(self.dataset['users']) + 1)
+
+    def auth(self, user_id):
+        return {'Authorization': f'Bearer {self.tokens(user_id)}'}
+
+    def league(self, rng):
+        # Popular leagues get viewed more, matching the membership skew
+        weights = self.dataset['league_cum_weights']
+        slot = bisect_left(weights, rng.random() * weights[-1])
+        return self.dataset['league_ids'][slot]
+
+    def next(self, rng):
+        """Returns (name, method, path, kwargs for the test client)."""
+        name = rng.choices(self.names, cum_weights=self.cum_weights)[0]
+        user_id = self.user(rng)
+        if name == 'auth_telegram':
+            return name, 'POST', '/api/auth/telegram', {'json': {'user': {'id': user_id, 'first_name': 'Bench', 'username': f'user{user_id}'}}}
+        if name == 'get_questions':
+            return name, 'GET', '/api/questions', {'headers': {'Accept-Encoding': 'gzip'}}
+        if name == 'sample_questions':
+            query = {'n': 10, 'category': rng.choice(CATEGORIES)}
+            return name, 'GET', '/api/questions/sample', {'query_string': query, 'headers': {'X-USER-ID': user_id}}
+        if name == 'submit_score':
+            correct = rng.randrange(11)
+            body = {'points': correct * 10, 'correct': correct, 'answered': 10, 'quiz_id': rng.choice(CATEGORIES)}
+            return name, 'POST', '/api/score/submit', {'json': body, 'headers': self.auth(user_id)}
+        if name == 'global_leaderboard':
+            return name, 'GET', '/api/leaderboard/global', {'query_string': {'limit': 50}}
+        if name == 'global_leaderboard?around':
+            return name, 'GET', '/api/leaderboard/global', {'query_string': {'around': user_id, 'radius': 10}}
+        if name == 'global_leaderboard?window':
+            return name, 'GET', '/api/leaderboard/global', {'query_string': {'window': rng.choice(['day', 'week', 'season']), 'limit': 50}}
+        if name == 'my_leagues':
+            return name, 'GET', '/api/leagues/my', {'headers': self.auth(user_id)}
+        if name == 'league_search':
+            word = rng.choice(WORDS)
+            return name, 'GET', '/api/league/search', {'query_string': {'query': word[:rng.randint(2, len(word))]}}
+        if name == 'league_leaderboard':
+            return name, 'GET', f'/api/leagues/{self.league(rng)}/leaderboard', {'query_string': {'limit': 20}}
+        return name, 'GET', '/api/status', {}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_load(flask_app, workload, total_requests, duration, concurrency, warmup, seed):
+    """Replays the mix on `concurrency` threads. Returns (samples, elapsed seconds)."""
+    samples = []
+    lock = threading.Lock()
+    issued = [0]
+    deadline = [None]
+
+    def claim():
+        with lock:
+            if deadline[0] is not None and time.perf_counter() >= deadline[0]:
+                return False
+            if total_requests and issued[0] >= total_requests:
+                return False
+            issued[0] += 1
+            return True
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = flask_app.test_client()
+        for _ in range(warmup):
+            name, method, path, kwargs = workload.next(rng)
+            client.open(path, method=method, **kwargs)
+        barrier.wait()
+        local = []
+        while claim():
+            name, method, path, kwargs = workload.next(rng)
+            started = time.perf_counter()
+            try:
+                status = client.open(path, method=method, **kwargs).status_code
+            except Exception as e:
+                print(f"Benchmark request {name} raised: {e}", file=sys.stderr)
+                status = 599
+            local.append((name, status, (time.perf_counter() - started) * 1000.0))
+        with lock:
+            samples.extend(local)
+
+    barrier = threading.Barrier(concurrency + 1)
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    if duration:
+        deadline[0] = started + duration
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    by_endpoint = {}
+    for name, status, ms in samples:
+        by_endpoint.setdefault(name, []).append((status, ms))
+
+    def stats(rows):
+        latencies = sorted(ms for _, ms in rows)
+        status_counts = {}
+        for status, _ in rows:
+            status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+        return {
+            'count': len(rows),
+            'errors': sum(1 for status, _ in rows if status >= 500),
+            'status_counts': status_counts,
+            'throughput_rps': round(len(rows) / elapsed, 2) if elapsed else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+        }
+
+    report = {'endpoints': {name: stats(rows) for name, rows in sorted(by_endpoint.items())}}
+    if samples:
+        report['overall'] = stats([(status, ms) for _, status, ms in samples])
+    return report
+
+
+def compare(report, baseline):
+    """Per-endpoint ratios against a previous report (>1 means this run is higher)."""
+    out = {}
+    for name, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        out[name] = {
+            key: round(current[key] / previous[key], 3) if previous.get(key) else None
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')
+        }
+    return out
+
+
+# --- CLI ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--mongo-uri', help='Run against this MongoDB instead of mongomock. Requires --drop.')
+    parser.add_argument('--drop', action='store_true', help=f'Allow dropping {DB_NAME} on the --mongo-uri server before and after the run.')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--leagues', type=int, default=100000)
+    parser.add_argument('--questions', type=int, default=50000)
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier applied to --users, --leagues and --questions.')
+    parser.add_argument('--memberships-per-user', type=float, default=1.5)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for league sizes.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=20000, help='Total measured requests (0 to run for --duration only).')
+    parser.add_argument('--duration', type=float, default=0, help='Stop after this many seconds.')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per thread before the run.')
+    parser.add_argument('--mix', help='JSON object overriding route weights, e.g. \'{"submit_score": 50}\'.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+    parser.add_argument('--baseline', help='Previous JSON report to compare against.')
+    args = parser.parse_args(argv)
+    if not args.requests and not args.duration:
+        parser.error('one of --requests or --duration is required')
+    if args.mongo_uri and not args.drop:
+        parser.error(f'--mongo-uri drops the {DB_NAME} database on that server; pass --drop to confirm it is a throwaway instance')
+    return args
+
+
+def run(args, mix):
+    """Seeds the backend, starts the app and runs the load. Returns the report."""
+    users = max(1, int(args.users * args.scale))
+    leagues = max(1, int(args.leagues * args.scale))
+    questions = max(1, int(args.questions * args.scale))
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # The app reads its configuration at import time
+    spill_dir = tempfile.mkdtemp(prefix='quiz-bench-')
+    os.environ['MONGO_URI'] = args.mongo_uri or 'mongodb://benchmark'
+    os.environ.setdefault('ADMIN_API_KEY', 'benchmark')
+    os.environ['TELEGRAM_BOT_TOKEN'] = ''
+    os.environ['SCORE_SPILL_PATH'] = os.path.join(spill_dir, 'spill.ndjson')
+    os.environ['INDEX_SELF_CHECK'] = ''
+    # Every simulated client shares one address; set RATE_LIMIT_ENABLED=true to measure the limiter too
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        backend = 'mongodb'
+    else:
+        MongoClient = use_mongomock()
+        backend = 'mongomock'
+    seed_client = MongoClient(os.environ['MONGO_URI'])
+    seed_client.drop_database(DB_NAME)
+
+    rng = random.Random(args.seed)
+    print(f"Seeding {users} users, {leagues} leagues, {questions} questions ({backend})...")
+    dataset = seed_dataset(seed_client[DB_NAME], users, leagues, questions, args.memberships_per_user, args.skew, rng)
+
+    import app as quiz_app
+    started = time.time()
+    flask_app = quiz_app.create_app()
+    startup_seconds = time.time() - started
+
+    token_lock = threading.Lock()
+    tokens = {}
+
+    def token_for(user_id):
+        with token_lock:
+            if user_id not in tokens:
+                tokens[user_id] = quiz_app.session_tokens.issue(user_id)[0]
+            return tokens[user_id]
+
+    workload = Workload(dataset, token_for, mix)
+    print(f"Running {args.requests or 'unbounded'} requests at concurrency {args.concurrency}...")
+    try:
+        samples, elapsed = run_load(flask_app, workload, args.requests, args.duration, args.concurrency, args.warmup, args.seed)
+    finally:
+        quiz_app.shutdown_services()
+        if args.mongo_uri:
+            seed_client.drop_database(DB_NAME)
+        seed_client.close()
+
+    report = {
+        'backend': backend,
+        'config': {
+            'users': users, 'leagues': leagues, 'questions': questions,
+            'memberships': dataset['memberships'], 'skew': args.skew,
+            'concurrency': args.concurrency, 'requests': args.requests, 'duration': args.duration,
+            'warmup': args.warmup, 'seed': args.seed, 'mix': mix,
+        },
+        'seed_seconds': round(dataset['seed_seconds'], 3),
+        'startup_seconds': round(startup_seconds, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'total_requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+    }
+    report.update(summarize(samples, elapsed))
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mix = dict(ROUTE_MIX, **json.loads(args.mix)) if args.mix else dict(ROUTE_MIX)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    unknown = set(mix) - set(ROUTE_MIX)
+    if unknown:
+        print(f"Unknown routes in --mix: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    # The app logs with print(); keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args, mix)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['vs_baseline'] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
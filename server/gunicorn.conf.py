@@ -0,0 +1,62 @@
+"""Production launcher config: `gunicorn -c gunicorn.conf.py`.
+
+Each worker process builds its own app (and so its own MongoClient pool, rank
+engines and background threads) through the create_app() factory after the
+fork. preload_app stays off for the same reason: loading the app in the
+master would share Mongo sockets and threads across forked workers.
+The per-worker rank engines are kept in step with each other by a periodic
+sync from Mongo (RANK_SYNC_INTERVAL, see app.sync_rank_engines).
+
+Tunables (environment):
+  PORT                  listen port (default 5000)
+  WEB_CONCURRENCY       worker processes (default 2 * CPUs + 1)
+  GUNICORN_THREADS      threads per worker (default 4)
+  GUNICORN_TIMEOUT      worker timeout in seconds (default 120); it also bounds
+                        a worker's boot, which seeds the rank engine and league
+                        search index from Mongo (~15 s for 1M users and 100k
+                        leagues), so raise it with the data
+  TRUSTED_PROXY_COUNT   reverse proxies / load balancers in front of gunicorn
+                        (default 0); client addresses come from X-Forwarded-For
+  RATE_LIMIT_BY_IP      turn on per-IP rate limits (default off); only with
+                        TRUSTED_PROXY_COUNT set, or every client behind the
+                        proxy shares one bucket
+Per-worker Mongo pool sizes come from MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE;
+keep workers * MONGO_MAX_POOL_SIZE within the cluster's connection limit.
+"""
+import os
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+wsgi_app = "app:create_app()"
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+workers = int(os.environ.get("WEB_CONCURRENCY", _cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = False
+
+# The arbiter kills a worker that has not heartbeated within timeout, and a
+# booting worker only starts heartbeating after create_app() has seeded its
+# engines
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# Leave time for the score ingest queue to drain on restart/shutdown
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+# Recycle workers periodically, jittered so they do not all restart together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
+
+
+def worker_exit(server, worker):
+    # Drain queued score writes and close this worker's Mongo pool
+    import app
+    app.shutdown_services()
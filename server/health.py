@@ -0,0 +1,97 @@
+"""Cheap health probes backed by a background-refreshed status snapshot.
+
+Load balancers poll health endpoints every few seconds on every instance, so
+the probes never talk to MongoDB themselves. HealthMonitor.refresh() runs on a
+timer, pings the server, reads estimated_document_count (collection metadata,
+not a scan) and copies the connection-pool counters kept by PoolStatsListener;
+the probes only read the last snapshot.
+"""
+import threading
+import time
+
+from pymongo import monitoring
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections across this process's pools."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+
+    def _add(self, field, amount):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {'open': self.open, 'checked_out': self.checked_out, 'checkout_failures': self.checkout_failures}
+
+    def connection_created(self, event):
+        self._add('open', 1)
+
+    def connection_closed(self, event):
+        self._add('open', -1)
+
+    def connection_checked_out(self, event):
+        self._add('checked_out', 1)
+
+    def connection_checked_in(self, event):
+        self._add('checked_out', -1)
+
+    def connection_check_out_failed(self, event):
+        self._add('checkout_failures', 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+class HealthMonitor:
+
+    def __init__(self, client, db, pool_stats, interval=10):
+        self.client = client
+        self.db = db
+        self.pool_stats = pool_stats
+        self.interval = interval
+        self._status = {'database': 'Unknown', 'quiz_count': 0, 'checked_at': None, 'error': None}
+
+    def refresh(self):
+        status = {'checked_at': time.time(), 'error': None}
+        try:
+            self.client.admin.command('ping')
+            status['database'] = 'Connected'
+            status['quiz_count'] = self.db.questions.estimated_document_count()
+        except Exception as e:
+            status['database'] = 'Failed'
+            status['quiz_count'] = self._status.get('quiz_count', 0)
+            status['error'] = str(e)
+        status['pool'] = self.pool_stats.snapshot()
+        self._status = status
+        return status
+
+    def status(self):
+        return dict(self._status)
+
+    def ready(self):
+        """Ready when the last refresh reached MongoDB and is not stale."""
+        status = self._status
+        if status['database'] != 'Connected' or status['checked_at'] is None:
+            return False
+        return time.time() - status['checked_at'] <= self.interval * 3
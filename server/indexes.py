@@ -0,0 +1,161 @@
+"""Index declarations for every hot collection, plus a query-plan self-check.
+
+ensure_indexes() runs at startup and creates whatever is missing; it is
+idempotent, so every worker can call it. check_query_plans() runs explain()
+for the query shape behind each route and reports any plan that falls back to
+a COLLSCAN. Run it at startup with INDEX_SELF_CHECK=1, through
+GET /api/admin/indexes/check, or from the command line:
+
+    python indexes.py --check
+"""
+import os
+import sys
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import IndexModel
+
+INDEXES = {
+    'users': [
+        IndexModel([('telegram_id', 1)], unique=True, name='telegram_id_1_unique'),
+        # Leaderboard order and keyset pagination
+        IndexModel([('overall_score', -1), ('telegram_id', 1)], name='overall_score_-1_telegram_id_1'),
+        # Periodic rank engine sync across workers
+        IndexModel([('updated_at', 1)], name='updated_at_1'),
+    ],
+    'questions': [
+        # Randomized sampling filters
+        IndexModel([('category', 1), ('difficulty', 1)], name='category_1_difficulty_1'),
+        # ?difficulty= alone has no category prefix to use the compound index
+        IndexModel([('difficulty', 1)], name='difficulty_1'),
+    ],
+    'leagues': [
+        # Public leagues store code None, so only string codes must be unique
+        IndexModel([('code', 1)], unique=True, name='code_1_unique', partialFilterExpression={'code': {'$type': 'string'}}),
+        IndexModel([('is_private', 1)], name='is_private_1'),
+    ],
+    'league_members': [
+        IndexModel([('league_id', 1), ('telegram_id', 1)], unique=True, name='league_id_1_telegram_id_1'),
+        IndexModel([('telegram_id', 1)], name='telegram_id_1'),
+        IndexModel([('league_id', 1), ('points', -1), ('telegram_id', 1)], name='league_id_1_points_-1_telegram_id_1'),
+    ],
+    'results': [
+        # Per-user history, newest first, with _id as the keyset tiebreaker
+        IndexModel([('telegram_id', 1), ('timestamp', -1), ('_id', -1)], name='telegram_id_1_timestamp_-1__id_-1'),
+    ],
+    'rate_limits': [
+        # Shared token buckets (RATE_LIMIT_BACKEND=mongo); idle buckets expire
+        IndexModel([('expires_at', 1)], expireAfterSeconds=0, name='expires_at_ttl'),
+    ],
+    'score_rollups': [
+        IndexModel([('window', 1), ('bucket', 1), ('telegram_id', 1)], unique=True, name='window_1_bucket_1_telegram_id_1'),
+        IndexModel([('window', 1), ('bucket', 1), ('points', -1), ('telegram_id', 1)], name='window_1_bucket_1_points_-1_telegram_id_1'),
+        IndexModel([('window', 1), ('bucket', 1), ('updated_at', 1)], name='window_1_bucket_1_updated_at_1'),
+        IndexModel([('expires_at', 1)], expireAfterSeconds=0, name='expires_at_ttl'),
+    ],
+}
+
+_SAMPLE_ID = ObjectId()
+_SAMPLE_TIME = datetime(2000, 1, 1)
+_LEADERBOARD_SORT = [('overall_score', -1), ('telegram_id', 1)]
+
+# (route, collection, filter, sort) for every query a route sends to Mongo.
+# Full-bank reads (get_questions, rank engine seeding) are scans by design and
+# are not listed.
+QUERY_SHAPES = [
+    ('auth_telegram', 'users', {'telegram_id': '0'}, None),
+    ('global_leaderboard', 'users', {}, _LEADERBOARD_SORT),
+    ('global_leaderboard?after_score', 'users', {'$or': [{'overall_score': {'$lt': 0}}, {'overall_score': 0, 'telegram_id': {'$gt': '0'}}]}, _LEADERBOARD_SORT),
+    ('rank_sync', 'users', {'updated_at': {'$gte': _SAMPLE_TIME}}, None),
+    ('window_rank_sync', 'score_rollups', {'window': 'week', 'bucket': '2000-W01', 'updated_at': {'$gte': _SAMPLE_TIME}}, None),
+    ('global_leaderboard?window', 'score_rollups', {'window': 'week', 'bucket': '2000-W01'}, [('points', -1), ('telegram_id', 1)]),
+    ('sample_questions', 'questions', {'category': '', 'difficulty': ''}, None),
+    ('sample_questions?difficulty', 'questions', {'difficulty': ''}, None),
+    ('check_join_league', 'leagues', {'code': 'AAAAAA', 'is_private': True}, None),
+    ('league_search_rebuild', 'leagues', {'is_private': False}, None),
+    ('my_leagues', 'league_members', {'telegram_id': '0'}, None),
+    ('league_membership', 'league_members', {'league_id': _SAMPLE_ID, 'telegram_id': '0'}, None),
+    ('user_results', 'results', {'telegram_id': '0'}, [('timestamp', -1), ('_id', -1)]),
+    ('league_leaderboard', 'league_members', {'league_id': _SAMPLE_ID}, [('points', -1), ('telegram_id', 1)]),
+]
+
+
+class IndexCheckError(Exception):
+    pass
+
+
+def ensure_collection_indexes(collection, name=None):
+    """Creates the declared indexes for one collection (name defaults to collection.name)."""
+    models = INDEXES.get(name or collection.name)
+    if models:
+        collection.create_indexes(models)
+
+
+def ensure_indexes(db):
+    """Creates every declared index. Returns {collection: error} for the ones that failed."""
+    errors = {}
+    for name in INDEXES:
+        try:
+            ensure_collection_indexes(db[name], name)
+        except Exception as e:
+            errors[name] = str(e)
+    return errors
+
+
+def _stages(plan):
+    """Yields every stage name in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def check_query_plans(db):
+    """Explains every route's query shape. Returns a list of per-route reports."""
+    reports = []
+    for route, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explained = cursor.limit(1).explain()
+            stages = sorted(set(_stages(explained.get('queryPlanner', {}).get('winningPlan', {}))))
+            reports.append({'route': route, 'collection': collection, 'stages': stages, 'collscan': 'COLLSCAN' in stages})
+        except Exception as e:
+            reports.append({'route': route, 'collection': collection, 'error': str(e), 'collscan': None})
+    return reports
+
+
+def assert_no_collscans(db):
+    """Raises IndexCheckError listing every route whose plan is a COLLSCAN or could not be explained."""
+    reports = check_query_plans(db)
+    failing = [r for r in reports if r['collscan'] is not False]
+    if failing:
+        details = ', '.join(f"{r['route']} ({r.get('error') or 'COLLSCAN'})" for r in failing)
+        raise IndexCheckError(f"Query plan self-check failed: {details}")
+    return reports
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    database = MongoClient(os.environ["MONGO_URI"]).quiz_database
+    failed = ensure_indexes(database)
+    for collection_name, error in failed.items():
+        print(f"Index creation failed on {collection_name}: {error}")
+    if '--check' in sys.argv:
+        for report in check_query_plans(database):
+            status = 'ERROR' if report['collscan'] is None else ('COLLSCAN' if report['collscan'] else 'ok')
+            print(f"{status:8} {report['route']:32} {report.get('stages') or report.get('error')}")
+        try:
+            assert_no_collscans(database)
+        except IndexCheckError as e:
+            print(e)
+            sys.exit(1)
+    sys.exit(1 if failed else 0)
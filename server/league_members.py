@@ -0,0 +1,89 @@
+"""League membership stored as one document per (league, user).
+
+Membership used to be an embedded `members` array on each league, which every
+read had to load just to call len() on it. Members now live in the
+league_members collection, and each league carries a denormalized
+member_count that join/create/leave keep in step.
+
+Each membership also carries the points the member has scored since joining;
+the score ingest queue adds to it (and to the league's `points` total), which
+is what the per-league leaderboard reads.
+"""
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+# counters document marking the embedded-members migration as done
+MIGRATION_MARKER = 'migration:league_members'
+
+
+def add_member(db, league_id, user_id):
+    """Adds user_id to the league. Returns False if they were already a member."""
+    try:
+        db.league_members.insert_one({'league_id': league_id, 'telegram_id': str(user_id), 'points': 0, 'joined_at': datetime.utcnow()})
+    except DuplicateKeyError:
+        return False
+    db.leagues.update_one({'_id': league_id}, {'$inc': {'member_count': 1}})
+    return True
+
+
+def remove_member(db, league_id, user_id):
+    """Removes user_id from the league, taking their points out of the league total.
+
+    Returns False if they were not a member.
+    """
+    membership = db.league_members.find_one_and_delete({'league_id': league_id, 'telegram_id': str(user_id)}, {'points': 1})
+    if membership is None:
+        return False
+    db.leagues.update_one({'_id': league_id}, {'$inc': {'member_count': -1, 'points': -membership.get('points', 0)}})
+    return True
+
+
+def is_member(db, league_id, user_id):
+    return db.league_members.find_one({'league_id': league_id, 'telegram_id': str(user_id)}, {'_id': 1}) is not None
+
+
+def league_ids_for_user(db, user_id):
+    cursor = db.league_members.find({'telegram_id': str(user_id)}, {'_id': 0, 'league_id': 1})
+    return [m['league_id'] for m in cursor]
+
+
+def migrate_embedded_members(db):
+    """Moves legacy `members` arrays into league_members. Safe to run repeatedly.
+
+    Returns the number of leagues migrated.
+    """
+    migrated = 0
+    for league in db.leagues.find({'members': {'$exists': True}}, {'members': 1}):
+        for user_id in set(str(m) for m in league.get('members') or []):
+            try:
+                db.league_members.insert_one({'league_id': league['_id'], 'telegram_id': user_id, 'points': 0, 'joined_at': datetime.utcnow()})
+            except DuplicateKeyError:
+                pass
+        member_count = db.league_members.count_documents({'league_id': league['_id']})
+        db.leagues.update_one({'_id': league['_id']}, {'$set': {'member_count': member_count}, '$unset': {'members': ''}})
+        migrated += 1
+    return migrated
+
+
+def ensure_members_migrated(db):
+    """Runs migrate_embedded_members once per database.
+
+    Finding legacy arrays is an unindexed scan of leagues, so a marker in
+    counters records that the migration finished and later boots skip it.
+    Returns the number of leagues migrated (0 once the marker exists).
+    """
+    if db.counters.find_one({'_id': MIGRATION_MARKER}, {'_id': 1}) is not None:
+        return 0
+    migrated = migrate_embedded_members(db)
+    db.counters.update_one({'_id': MIGRATION_MARKER}, {'$set': {'done_at': datetime.utcnow(), 'leagues': migrated}}, upsert=True)
+    return migrated
+
+
+def league_leaderboard(db, league_id, limit):
+    """Top members of one league by points scored since joining."""
+    cursor = db.league_members.find(
+        {'league_id': league_id},
+        {'_id': 0, 'telegram_id': 1, 'points': 1}
+    ).sort([('points', -1), ('telegram_id', 1)]).limit(limit)
+    return list(cursor)
@@ -0,0 +1,145 @@
+"""In-process prefix index for public league search.
+
+Every word of a league's name and description is indexed under all of its
+prefixes (up to MAX_PREFIX characters), so a debounced keystroke search is a
+handful of dict lookups instead of an unanchored $regex collection scan.
+Queries are split into words and every query word must prefix-match some
+indexed word; matches in the name outrank matches in the description.
+
+Leagues are only ever created, so a refresh just indexes the leagues whose
+_id is newer than the newest one already seen; a full rebuild is only needed
+to pick up edits made outside the app.
+"""
+import re
+import threading
+from datetime import timedelta
+
+from bson.objectid import ObjectId
+
+MAX_PREFIX = 20
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+EXACT_WORD_BONUS = 1
+NAME_PREFIX_BONUS = 2
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _WORD_RE.findall((text or '').lower())
+
+
+class LeagueSearchIndex:
+    """Prefix -> {league_id: weight} inverted index over public leagues."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._docs = {}
+        self._newest_id = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    @staticmethod
+    def _terms(name, description):
+        """Maps each prefix to (weight, exact_words) for one league."""
+        terms = {}
+        for words, weight in ((tokenize(description), DESCRIPTION_WEIGHT), (tokenize(name), NAME_WEIGHT)):
+            for word in words:
+                for end in range(1, min(len(word), MAX_PREFIX) + 1):
+                    prefix = word[:end]
+                    bonus = EXACT_WORD_BONUS if end == len(word) else 0
+                    terms[prefix] = max(terms.get(prefix, 0), weight + bonus)
+        return terms
+
+    def upsert(self, league_id, name, description):
+        league_id = str(league_id)
+        terms = self._terms(name, description)
+        with self._lock:
+            self._unindex(league_id)
+            self._docs[league_id] = (name or '', (name or '').lower(), terms)
+            for prefix, weight in terms.items():
+                self._postings.setdefault(prefix, {})[league_id] = weight
+
+    def _unindex(self, league_id):
+        doc = self._docs.pop(league_id, None)
+        if doc is None:
+            return
+        for prefix in doc[2]:
+            posting = self._postings.get(prefix)
+            if posting is not None:
+                posting.pop(league_id, None)
+                if not posting:
+                    del self._postings[prefix]
+
+    def rebuild(self, leagues):
+        """Replaces the index contents with an iterable of (league_id, name, description)."""
+        fresh = LeagueSearchIndex()
+        for league_id, name, description in leagues:
+            fresh.upsert(league_id, name, description)
+        with self._lock:
+            self._postings = fresh._postings
+            self._docs = fresh._docs
+
+    def _seen(self, leagues):
+        """Passes leagues through, remembering the newest ObjectId among them."""
+        for league in leagues:
+            league_id = league['_id']
+            if isinstance(league_id, ObjectId) and (self._newest_id is None or league_id > self._newest_id):
+                self._newest_id = league_id
+            yield league_id, league.get('name'), league.get('description')
+
+    def rebuild_from_collection(self, leagues_collection):
+        self._newest_id = None
+        cursor = leagues_collection.find({'is_private': False}, {'name': 1, 'description': 1})
+        self.rebuild(self._seen(cursor))
+        return len(self)
+
+    def refresh_from_collection(self, leagues_collection, overlap=60):
+        """Indexes public leagues created since the newest one seen. Returns how many were read.
+
+        Workers assign ObjectIds independently, so a league can commit after
+        one with a later id; the scan starts overlap seconds before the newest
+        id seen and re-indexes the leagues it overlaps.
+        """
+        if self._newest_id is None:
+            return self.rebuild_from_collection(leagues_collection)
+        since = ObjectId.from_datetime(self._newest_id.generation_time - timedelta(seconds=overlap))
+        cursor = leagues_collection.find({'_id': {'$gt': since}, 'is_private': False}, {'name': 1, 'description': 1})
+        count = 0
+        for league_id, name, description in self._seen(cursor):
+            self.upsert(league_id, name, description)
+            count += 1
+        return count
+
+    def search(self, query, limit):
+        """Returns up to limit league ids, best match first.
+
+        An empty query returns leagues in index order.
+        """
+        words = [w[:MAX_PREFIX] for w in tokenize(query)]
+        with self._lock:
+            if not words:
+                return [league_id for league_id, _ in zip(self._docs, range(limit))]
+
+            # Intersect starting from the rarest word to keep the candidate set small
+            postings = [self._postings.get(w) for w in words]
+            if any(p is None for p in postings):
+                return []
+            postings.sort(key=len)
+            scores = dict(postings[0])
+            for posting in postings[1:]:
+                scores = {lid: s + posting[lid] for lid, s in scores.items() if lid in posting}
+                if not scores:
+                    return []
+
+            phrase = ' '.join(words)
+            ranked = []
+            for league_id, score in scores.items():
+                name, name_lower, _ = self._docs[league_id]
+                if name_lower.startswith(phrase):
+                    score += NAME_PREFIX_BONUS
+                ranked.append((-score, name_lower, league_id))
+        ranked.sort()
+        return [league_id for _, _, league_id in ranked[:limit]]
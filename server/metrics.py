@@ -0,0 +1,181 @@
+"""Request and MongoDB instrumentation exposed in Prometheus text format.
+
+Metrics.init_app() wraps every request to record latency and response size
+per route; Metrics.command_listener is a pymongo CommandListener (pass it to
+MongoClient(event_listeners=[...])) that records command counts and durations,
+attributed to the route that issued them. Requests slower than the slow
+threshold are printed with their Mongo command count.
+
+Metrics are per process: with several gunicorn workers each scrape sees the
+worker that answered it.
+"""
+import bisect
+import threading
+import time
+
+from flask import g, request
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_local = threading.local()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per-bucket counts (last slot is +Inf), then sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        names = self.label_names + ('le',)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command and attributes it to the current request's route."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def _record(self, event, outcome):
+        route = getattr(_local, 'route', None) or 'background'
+        self.metrics.mongo_duration.observe((event.command_name, route), event.duration_micros / 1e6)
+        if outcome != 'ok':
+            self.metrics.mongo_failures.inc((event.command_name, route))
+        if getattr(_local, 'route', None):
+            _local.commands += 1
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, 'ok')
+
+    def failed(self, event):
+        self._record(event, 'failed')
+
+
+class Metrics:
+
+    def __init__(self, slow_threshold_ms=500):
+        self.slow_threshold = slow_threshold_ms / 1000.0
+        self.request_latency = Histogram('http_request_duration_seconds', 'HTTP request latency by route.', ('route', 'method', 'status'), LATENCY_BUCKETS)
+        self.response_size = Histogram('http_response_size_bytes', 'HTTP response body size by route.', ('route', 'method'), SIZE_BUCKETS)
+        self.mongo_duration = Histogram('mongo_command_duration_seconds', 'MongoDB command latency by command and route.', ('command', 'route'), LATENCY_BUCKETS)
+        self.mongo_failures = Counter('mongo_command_failures_total', 'Failed MongoDB commands by command and route.', ('command', 'route'))
+        self.slow_requests = Counter('http_slow_requests_total', 'Requests slower than the slow-request threshold.', ('route', 'method'))
+        self.command_listener = MongoCommandListener(self)
+        self._gauges = []
+        self._counters = []
+
+    def counter(self, name, help_text, label_names):
+        """Registers and returns an extra Counter rendered with the built-in metrics."""
+        counter = Counter(name, help_text, label_names)
+        self._counters.append(counter)
+        return counter
+
+    def gauge(self, name, help_text, fn):
+        """Registers a gauge whose value is read from fn() at scrape time."""
+        self._gauges.append((name, help_text, fn))
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def _route():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        _local.route = self._route()
+        _local.commands = 0
+
+    def _after_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route, method = self._route(), request.method
+        self.request_latency.observe((route, method, str(response.status_code)), elapsed)
+        if not response.is_streamed and response.content_length is not None:
+            self.response_size.observe((route, method), response.content_length)
+        if elapsed >= self.slow_threshold:
+            self.slow_requests.inc((route, method))
+            print(f"Slow request: {method} {request.full_path.rstrip('?')} -> {response.status_code} "
+                  f"in {elapsed * 1000:.1f} ms ({getattr(_local, 'commands', 0)} Mongo commands)")
+        return response
+
+    def _teardown_request(self, exc):
+        _local.route = None
+
+    def render(self):
+        lines = []
+        for metric in (self.request_latency, self.response_size, self.slow_requests, self.mongo_duration, self.mongo_failures, *self._counters):
+            lines.extend(metric.render())
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+        return '\n'.join(lines) + '\n'
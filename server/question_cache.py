@@ -0,0 +1,93 @@
+"""In-memory cache of the serialized question bank.
+
+The questions collection only changes when an admin uploads a new bank, so
+GET /api/questions serves pre-built bytes: the JSON body, a gzip copy, a
+brotli copy when the brotli package is installed, and a content hash used as
+the ETag. upload_quiz invalidates the cache; a TTL makes other workers pick up
+the new bank too.
+"""
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+class QuestionBank:
+    """One immutable, fully serialized version of the question bank."""
+    __slots__ = ('body', 'gzip_body', 'brotli_body', 'etag', 'count', 'built_at')
+
+    def __init__(self, body, count):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6)
+        self.brotli_body = brotli.compress(body) if brotli is not None else None
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.count = count
+        self.built_at = time.monotonic()
+
+
+class QuestionBankCache:
+    """Builds the QuestionBank on first use and after invalidation or TTL expiry."""
+
+    def __init__(self, loader, dumps, ttl=300):
+        self._loader = loader
+        self._dumps = dumps
+        self.ttl = ttl
+        self._bank = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._bank = None
+
+    def _fresh(self, bank):
+        return bank is not None and (not self.ttl or time.monotonic() - bank.built_at < self.ttl)
+
+    def get(self):
+        bank = self._bank
+        if self._fresh(bank):
+            return bank
+        # Only one thread rebuilds; the rest wait and reuse its result
+        with self._lock:
+            bank = self._bank
+            if self._fresh(bank):
+                return bank
+            questions = self._loader()
+            bank = QuestionBank(self._dumps(questions).encode('utf-8'), len(questions))
+            self._bank = bank
+            return bank
+
+
+class RecentQuestions:
+    """Per-user memory of recently served question ids.
+
+    Each user keeps at most per_user ids (oldest dropped first) and the store
+    keeps at most max_users users, evicting the least recently active.
+    """
+
+    def __init__(self, per_user=200, max_users=10000):
+        self.per_user = per_user
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            recent = self._users.get(user_id)
+            return list(recent) if recent else []
+
+    def add(self, user_id, question_ids):
+        with self._lock:
+            recent = self._users.get(user_id)
+            if recent is None:
+                recent = deque(maxlen=self.per_user)
+                self._users[user_id] = recent
+            else:
+                self._users.move_to_end(user_id)
+            recent.extend(question_ids)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
@@ -0,0 +1,122 @@
+"""Streaming bulk loader for the question bank.
+
+Uploads are read as NDJSON in fixed-size chunks, validated record by record
+and written to a staging collection in unordered insert_many batches. Only
+when every record made it in is the staging collection renamed over the live
+one, so readers see either the old bank or the new one, never a partial mix.
+"""
+import json
+import time
+import uuid
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Raised for an upload that must be rejected as a whole."""
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+
+
+class UploadStats:
+    __slots__ = ('bytes', 'docs', 'batches', 'started')
+
+    def __init__(self):
+        self.bytes = 0
+        self.docs = 0
+        self.batches = 0
+        self.started = time.monotonic()
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'inserted_count': self.docs,
+            'bytes': self.bytes,
+            'batches': self.batches,
+            'elapsed_seconds': round(elapsed, 3),
+            'docs_per_second': round(self.docs / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def iter_ndjson(stream, stats, chunk_size=READ_CHUNK_SIZE):
+    """Yields (line_number, record) from a binary NDJSON stream, chunk by chunk."""
+    buffer = b''
+    line_number = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        stats.bytes += len(chunk)
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line_number += 1
+            record = _parse_line(line, line_number)
+            if record is not None:
+                yield line_number, record
+    if buffer.strip():
+        line_number += 1
+        yield line_number, _parse_line(buffer, line_number)
+
+
+def iter_json_list(data):
+    """Adapts an already-parsed JSON list to the same (line_number, record) shape."""
+    if not isinstance(data, list):
+        raise UploadError("Invalid data format. Expected a non-empty list of question objects.")
+    for index, record in enumerate(data, start=1):
+        yield index, record
+
+
+def _parse_line(line, line_number):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise UploadError(f"Invalid JSON on line {line_number}: {e}", line=line_number)
+
+
+def validate_question(record, line_number):
+    if not isinstance(record, dict) or not record:
+        raise UploadError(f"Record {line_number} is not a non-empty question object.", line=line_number)
+    return record
+
+
+def load_and_swap(db, target_name, records, stats, batch_size=1000, prepare=None):
+    """Loads records into a staging collection and renames it over target_name.
+
+    prepare(staging_collection) runs before the swap, e.g. to build indexes so
+    the live collection is never without them. Returns the number of documents
+    the previous collection held. The staging collection is dropped on failure.
+    """
+    staging = db[f"{target_name}_staging_{uuid.uuid4().hex[:12]}"]
+    try:
+        batch = []
+        for line_number, record in records:
+            batch.append(validate_question(record, line_number))
+            if len(batch) >= batch_size:
+                _flush(staging, batch, stats)
+                batch = []
+        if batch:
+            _flush(staging, batch, stats)
+        if stats.docs == 0:
+            raise UploadError("Invalid data format. Expected a non-empty list of question objects.")
+
+        if prepare is not None:
+            prepare(staging)
+        previous_count = db[target_name].estimated_document_count()
+        staging.rename(target_name, dropTarget=True)
+        return previous_count
+    except Exception:
+        staging.drop()
+        raise
+
+
+def _flush(collection, batch, stats):
+    collection.insert_many(batch, ordered=False)
+    stats.docs += len(batch)
+    stats.batches += 1
@@ -0,0 +1,328 @@
+"""In-process rank engine for the global leaderboard.
+
+Scores live in an indexable skip list (the structure Redis uses for sorted
+sets), ordered by score descending and telegram_id ascending. Every node keeps
+the span of each forward link, so "how many users are ahead of me" and
+"where does this keyset page start" are O(log n) walks instead of a collection scan.
+
+MongoDB stays the source of truth: the engine is seeded from the users
+collection at startup, updated on every score change, synced periodically
+with users other workers updated, and can be checked (and repaired) against
+Mongo on demand.
+"""
+import heapq
+import random
+import threading
+from datetime import datetime
+
+MAX_LEVEL = 32
+LEVEL_PROBABILITY = 0.25
+# Keys sorted per run when taking a snapshot; bounds each GIL-holding sort to a few ms
+SNAPSHOT_SORT_RUN = 20000
+# Served by the users overall_score_-1_telegram_id_1 index
+LEADERBOARD_SORT = [('overall_score', -1), ('telegram_id', 1)]
+
+
+class _Node:
+    __slots__ = ('key', 'forward', 'span')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.forward = [None] * level
+        self.span = [0] * level
+
+
+class SkipList:
+    """Indexable skip list of comparable keys (no duplicates)."""
+
+    def __init__(self):
+        self.head = _Node(None, MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def from_sorted(cls, keys):
+        """Builds a list from keys already in ascending order, in O(n).
+
+        Nodes are appended at the tail of every level they reach, so nothing
+        is searched for; each level remembers its last node and that node's
+        position to fill in the spans.
+        """
+        skiplist = cls()
+        last = [skiplist.head] * MAX_LEVEL
+        last_pos = [0] * MAX_LEVEL
+        position = 0
+        for key in keys:
+            position += 1
+            level = cls._random_level()
+            node = _Node(key, level)
+            for i in range(level):
+                last[i].forward[i] = node
+                last[i].span[i] = position - last_pos[i]
+                last[i] = node
+                last_pos[i] = position
+            if level > skiplist.level:
+                skiplist.level = level
+        for i in range(skiplist.level):
+            last[i].span[i] = position - last_pos[i]
+        skiplist.length = position
+        return skiplist
+
+    @staticmethod
+    def _random_level():
+        level = 1
+        while level < MAX_LEVEL and random.random() < LEVEL_PROBABILITY:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [None] * MAX_LEVEL
+        rank = [0] * MAX_LEVEL
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while x.forward[i] is not None and x.forward[i].key < key:
+                rank[i] += x.span[i]
+                x = x.forward[i]
+            update[i] = x
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                update[i].span[i] = self.length
+            self.level = level
+
+        node = _Node(key, level)
+        for i in range(level):
+            node.forward[i] = update[i].forward[i]
+            update[i].forward[i] = node
+            node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = (rank[0] - rank[i]) + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        self.length += 1
+
+    def remove(self, key):
+        """Removes key if present. Returns True when a node was unlinked."""
+        update = [None] * MAX_LEVEL
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and x.forward[i].key < key:
+                x = x.forward[i]
+            update[i] = x
+
+        x = x.forward[0]
+        if x is None or x.key != key:
+            return False
+
+        for i in range(self.level):
+            if update[i].forward[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].forward[i] = x.forward[i]
+            else:
+                update[i].span[i] -= 1
+        while self.level > 1 and self.head.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def count_less(self, key):
+        """Number of keys strictly smaller than key."""
+        traversed = 0
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and x.forward[i].key < key:
+                traversed += x.span[i]
+                x = x.forward[i]
+        return traversed
+
+    def iter_from(self, index):
+        """Yields keys in order starting at 0-based position index."""
+        if index < 0 or index >= self.length:
+            return
+        target = index + 1
+        traversed = 0
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and traversed + x.span[i] <= target:
+                traversed += x.span[i]
+                x = x.forward[i]
+            if traversed == target:
+                break
+        while x is not None:
+            yield x.key
+            x = x.forward[0]
+
+
+class RankSnapshot:
+    """Frozen copy of leaderboard positions at a point in time.
+
+    members holds telegram_ids in leaderboard order; the index maps each id
+    back to its slot so previous-rank lookups are a single dict probe.
+    """
+    __slots__ = ('members', 'taken_at', '_index')
+
+    def __init__(self, members, taken_at=None):
+        self.members = members
+        self.taken_at = taken_at or datetime.utcnow()
+        self._index = {member: slot for slot, member in enumerate(members)}
+
+    def __len__(self):
+        return len(self.members)
+
+    def rank(self, member):
+        """1-based position of member when the snapshot was taken, or None."""
+        slot = self._index.get(str(member))
+        return None if slot is None else slot + 1
+
+
+class RankEngine:
+    """Thread-safe sorted set of telegram_id -> overall_score."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._scores = {}
+        self._list = SkipList()
+
+    @staticmethod
+    def _key(member, score):
+        return (-score, member)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, member):
+        return str(member) in self._scores
+
+    def seed(self, pairs):
+        """Rebuilds the engine from an iterable of (telegram_id, score) pairs."""
+        scores = {}
+        for member, score in pairs:
+            scores[str(member)] = int(score or 0)
+        # Already-ordered input (seed_from_collection) makes this sort a linear pass
+        skiplist = SkipList.from_sorted(sorted(self._key(member, score) for member, score in scores.items()))
+        with self._lock:
+            self._scores = scores
+            self._list = skiplist
+
+    def seed_from_collection(self, users_collection):
+        """Seeds the engine from the Mongo users collection, read in leaderboard order."""
+        cursor = users_collection.find({}, {'_id': 0, 'telegram_id': 1, 'overall_score': 1}).sort(LEADERBOARD_SORT)
+        self.seed((u['telegram_id'], u.get('overall_score')) for u in cursor if u.get('telegram_id') is not None)
+        return len(self)
+
+    def sync_from_collection(self, users_collection, since):
+        """Applies the stored score of every user updated at or after since. Returns how many were read."""
+        cursor = users_collection.find({'updated_at': {'$gte': since}}, {'_id': 0, 'telegram_id': 1, 'overall_score': 1})
+        count = 0
+        for u in cursor:
+            if u.get('telegram_id') is not None:
+                self.update(u['telegram_id'], u.get('overall_score'))
+                count += 1
+        return count
+
+    def update(self, member, score):
+        """Sets a member's score, inserting the member if it is new."""
+        member = str(member)
+        score = int(score or 0)
+        with self._lock:
+            old = self._scores.get(member)
+            if old == score:
+                return
+            if old is not None:
+                self._list.remove(self._key(member, old))
+            self._scores[member] = score
+            self._list.insert(self._key(member, score))
+
+    def increment(self, member, delta):
+        """Adds delta to a member's score and returns the new score."""
+        member = str(member)
+        with self._lock:
+            score = self._scores.get(member, 0) + int(delta)
+            self.update(member, score)
+            return score
+
+    def rank(self, member):
+        """1-based competition rank (users with a higher score + 1), or None if unknown."""
+        with self._lock:
+            score = self._scores.get(str(member))
+            if score is None:
+                return None
+            return self._list.count_less((-score, '')) + 1
+
+    def position(self, member):
+        """0-based position in leaderboard order, or None if unknown."""
+        member = str(member)
+        with self._lock:
+            score = self._scores.get(member)
+            if score is None:
+                return None
+            return self._list.count_less(self._key(member, score))
+
+    def position_after(self, score, member):
+        """Number of members at or before (score, member) in leaderboard order.
+
+        This is the 0-based position of the first row of a keyset page whose
+        cursor is (score, member).
+        """
+        key = self._key(str(member), int(score or 0))
+        with self._lock:
+            count = self._list.count_less(key)
+            if self._scores.get(str(member)) == int(score or 0):
+                count += 1
+            return count
+
+    def snapshot(self):
+        """Captures the current leaderboard order as a RankSnapshot.
+
+        Only copying the scores happens under the lock. The copy is then put in
+        leaderboard order outside it, as sorted runs of SNAPSHOT_SORT_RUN keys
+        merged lazily: one sort of every key would hold the GIL (and stall the
+        whole worker) for seconds at a million users.
+        """
+        with self._lock:
+            scores = self._scores.copy()
+        keys = [self._key(member, score) for member, score in scores.items()]
+        runs = [sorted(keys[i:i + SNAPSHOT_SORT_RUN]) for i in range(0, len(keys), SNAPSHOT_SORT_RUN)]
+        return RankSnapshot([member for _, member in heapq.merge(*runs)])
+
+    def verify_against(self, users_collection, repair=False):
+        """Compares the engine with Mongo and optionally reseeds it.
+
+        Returns a report with counts of missing, extra and mismatched members
+        plus a small sample of each for debugging.
+        """
+        cursor = users_collection.find({}, {'_id': 0, 'telegram_id': 1, 'overall_score': 1})
+        truth = {}
+        for u in cursor:
+            if u.get('telegram_id') is not None:
+                truth[str(u['telegram_id'])] = int(u.get('overall_score') or 0)
+
+        with self._lock:
+            snapshot = dict(self._scores)
+
+        missing = [m for m in truth if m not in snapshot]
+        extra = [m for m in snapshot if m not in truth]
+        mismatched = [m for m, s in truth.items() if m in snapshot and snapshot[m] != s]
+
+        report = {
+            'consistent': not (missing or extra or mismatched),
+            'mongo_count': len(truth),
+            'engine_count': len(snapshot),
+            'missing_count': len(missing),
+            'extra_count': len(extra),
+            'mismatched_count': len(mismatched),
+            'missing_sample': missing[:10],
+            'extra_sample': extra[:10],
+            'mismatched_sample': mismatched[:10],
+            'repaired': False,
+        }
+        if repair and not report['consistent']:
+            self.seed(truth.items())
+            report['repaired'] = True
+        return report
@@ -0,0 +1,175 @@
+"""Token-bucket rate limiting, checked before a route does any MongoDB work.
+
+Each (scope, route, identity) gets a bucket holding up to `burst` tokens that
+refills at `rate` tokens per second; a request takes one token or is answered
+429 with a Retry-After header. Scopes are "user" (the id resolved from the
+session token or legacy header) and "ip" (request.remote_addr, which the app
+resolves through ProxyFix when it runs behind trusted proxies). The ip scope
+is opt-in: behind a proxy that is not configured, every client shares the
+proxy's address and so one bucket.
+
+Buckets live in a store with a single take() method, so the backend is
+pluggable:
+
+- MemoryBucketStore (default) keeps buckets in this process, in an LRU map
+  of at most maxsize keys. A check is a dict probe under a lock. Limits are
+  per worker, so the effective limit is the configured one times the number
+  of workers.
+- MongoBucketStore shares buckets across workers through one atomic
+  find_one_and_update per check. It costs a round trip, but the update is on
+  _id and never scans.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import jsonify, request, make_response
+from pymongo import ReturnDocument
+
+SCOPES = ('user', 'ip')
+
+
+class MemoryBucketStore:
+    """In-process token buckets for up to maxsize keys, least recently used evicted first.
+
+    An evicted key comes back with a full bucket, so maxsize should comfortably
+    exceed the number of clients active within one refill period.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, rate, burst, cost=1):
+        """Takes cost tokens from key's bucket. Returns 0 when allowed, else seconds until they refill."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._buckets.get(key)
+            tokens = burst if entry is None else min(burst, entry[0] + (now - entry[1]) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoBucketStore:
+    """Token buckets shared by every worker, one document per key.
+
+    Refill, check and take happen in a single pipeline update, so concurrent
+    workers never over-grant. Idle buckets are removed by the TTL index on
+    expires_at (see indexes.py). Requires MongoDB 4.2+.
+    """
+
+    def __init__(self, collection, idle_ttl=3600):
+        self.collection = collection
+        self.idle_ttl = idle_ttl
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.time()
+        elapsed = {'$max': [0, {'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}]}
+        pipeline = [
+            {'$set': {
+                'tokens': {'$min': [burst, {'$add': [{'$ifNull': ['$tokens', burst]}, {'$multiply': [elapsed, rate]}]}]},
+                'updated_at': now,
+            }},
+            {'$set': {'allowed': {'$gte': ['$tokens', cost]}}},
+            {'$set': {
+                'tokens': {'$cond': ['$allowed', {'$subtract': ['$tokens', cost]}, '$tokens']},
+                'expires_at': datetime.utcnow() + timedelta(seconds=self.idle_ttl),
+            }},
+        ]
+        bucket = self.collection.find_one_and_update(
+            {'_id': key}, pipeline, projection={'tokens': 1, 'allowed': 1},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        if bucket['allowed']:
+            return 0.0
+        return (cost - bucket['tokens']) / rate
+
+
+def parse_limits(spec, scopes=SCOPES):
+    """Normalizes {route: {scope: [rate, burst]}} into {route: {scope: (rate, burst)}}. Raises ValueError.
+
+    Rules for valid scopes missing from scopes are dropped, so a route limited
+    only by a disabled scope ends up unlimited.
+    """
+    limits = {}
+    for route, rules in spec.items():
+        if not isinstance(rules, dict):
+            raise ValueError(f"Limits for {route} must be an object of scope -> [rate, burst].")
+        parsed = {}
+        for scope, values in rules.items():
+            if scope not in SCOPES:
+                raise ValueError(f"Unknown rate limit scope {scope!r} for {route}.")
+            try:
+                rate, burst = float(values[0]), float(values[1])
+            except (TypeError, IndexError, KeyError):
+                raise ValueError(f"Rate limit for {route}/{scope} must be [rate, burst].")
+            if rate <= 0 or burst < 1:
+                raise ValueError(f"Rate limit for {route}/{scope} needs rate > 0 and burst >= 1.")
+            if scope in scopes:
+                parsed[scope] = (rate, burst)
+        limits[route] = parsed
+    return limits
+
+
+class RateLimiter:
+    """Applies per-route limits from a before_request hook.
+
+    limits maps Flask endpoint names to {scope: (rate, burst)}; endpoints
+    without an entry use limits['default'] if present. An empty dict turns
+    limiting off for that endpoint. user_key() returns the caller's user id
+    (or None) without touching the database.
+    """
+
+    def __init__(self, store, limits, user_key, metrics=None):
+        self.store = store
+        self.limits = limits
+        self.user_key = user_key
+        self.rejected = metrics.counter('http_rate_limited_total', 'Requests rejected by the rate limiter.', ('route', 'scope')) if metrics else None
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+
+    def _identity(self, scope):
+        if scope == 'user':
+            return self.user_key()
+        return request.remote_addr
+
+    def _before_request(self):
+        if request.method == 'OPTIONS' or request.endpoint is None:
+            return None
+        rules = self.limits.get(request.endpoint, self.limits.get('default'))
+        if not rules:
+            return None
+
+        for scope, (rate, burst) in rules.items():
+            identity = self._identity(scope)
+            if identity is None:
+                continue
+            try:
+                wait = self.store.take(f"{scope}:{request.endpoint}:{identity}", rate, burst)
+            except Exception as e:
+                # A broken shared store must not take the API down with it
+                print(f"Error checking rate limit: {e}")
+                return None
+            if wait:
+                if self.rejected is not None:
+                    self.rejected.inc((request.endpoint, scope))
+                retry_after = max(1, math.ceil(wait))
+                response = make_response(jsonify({"message": "Too many requests. Please slow down.", "retry_after": retry_after}), 429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+        return None
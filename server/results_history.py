@@ -0,0 +1,115 @@
+"""Reads over the results collection: per-user history and a streamed export.
+
+Every submission lands in results (through the score ingest queue) as
+{telegram_id, quiz_id, points, correct, answered, timestamp}. A user's history
+is a keyset walk of the (telegram_id, timestamp desc, _id desc) index: the
+cursor is the (timestamp, _id) of the last row served, so page N costs the
+same as page 1. The export streams the collection as NDJSON straight from a
+batched cursor, so a full pull never sits in worker memory.
+"""
+import json
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+HISTORY_SORT = [('timestamp', -1), ('_id', -1)]
+HISTORY_PROJECTION = {'telegram_id': 0}
+
+
+def parse_cursor(before_timestamp, before_id):
+    """Turns the before_timestamp/before_id query args into (datetime, ObjectId). Raises ValueError."""
+    if not ObjectId.is_valid(before_id):
+        raise ValueError('before_id is not a valid id.')
+    return datetime.fromisoformat(before_timestamp), ObjectId(before_id)
+
+
+def _before_cursor_query(timestamp, result_id):
+    """Keyset filter for rows strictly after (timestamp, _id) in newest-first order."""
+    return {'$or': [
+        {'timestamp': {'$lt': timestamp}},
+        {'timestamp': timestamp, '_id': {'$lt': result_id}}
+    ]}
+
+
+def history_page(collection, user_id, limit, cursor=None):
+    """Returns (rows, next_cursor) for one page of a user's results, newest first.
+
+    next_cursor is the (timestamp, _id) to pass back for the following page,
+    or None on the last page.
+    """
+    query = {'telegram_id': str(user_id)}
+    if cursor is not None:
+        query.update(_before_cursor_query(*cursor))
+    # One extra row tells us whether another page exists without a count
+    rows = list(collection.find(query, HISTORY_PROJECTION).sort(HISTORY_SORT).limit(limit + 1))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = (rows[-1]['timestamp'], rows[-1]['_id']) if has_more else None
+    return rows, next_cursor
+
+
+def quiz_aggregates(collection, user_id):
+    """Per-quiz totals for one user, most recently played first."""
+    pipeline = [
+        {'$match': {'telegram_id': str(user_id)}},
+        {'$group': {
+            '_id': '$quiz_id',
+            'attempts': {'$sum': 1},
+            'total_points': {'$sum': '$points'},
+            'best_points': {'$max': '$points'},
+            'correct': {'$sum': '$correct'},
+            'answered': {'$sum': '$answered'},
+            'last_played': {'$max': '$timestamp'},
+        }},
+        {'$sort': {'last_played': -1}},
+    ]
+    out = []
+    for row in collection.aggregate(pipeline):
+        answered = row.get('answered') or 0
+        out.append({
+            'quiz_id': row['_id'],
+            'attempts': row['attempts'],
+            'total_points': row['total_points'],
+            'best_points': row['best_points'],
+            'correct': row['correct'],
+            'answered': answered,
+            'accuracy': round(row['correct'] / answered, 4) if answered else None,
+            'last_played': row['last_played'].isoformat() if row.get('last_played') else None,
+        })
+    return out
+
+
+def serialize_result(doc):
+    out = dict(doc)
+    if '_id' in out:
+        out['_id'] = str(out['_id'])
+    if isinstance(out.get('timestamp'), datetime):
+        out['timestamp'] = out['timestamp'].isoformat()
+    return out
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_ndjson_export(collection, query=None, batch_size=1000):
+    """Yields the matching results as NDJSON, one chunk per cursor batch.
+
+    The cursor is read in batch_size round trips in _id order (the export
+    resumes cleanly from the last _id seen) and nothing beyond the current
+    batch is held in memory.
+    """
+    cursor = collection.find(query or {}).sort('_id', 1).batch_size(batch_size)
+    lines = []
+    try:
+        for doc in cursor:
+            lines.append(json.dumps(doc, default=_json_default, separators=(',', ':')))
+            if len(lines) >= batch_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+    finally:
+        cursor.close()
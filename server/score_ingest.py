@@ -0,0 +1,312 @@
+"""Write-behind ingestion queue for quiz results.
+
+submit_score used to make four Mongo round-trips on the request thread. It now
+makes one (the user's overall_score, which it returns) and appends the result
+to this in-memory queue. A background thread flushes the queue every
+flush_interval seconds, or as soon as flush_size results are waiting:
+
+- results are written with one unordered insert_many (each result carries a
+  pre-assigned _id, so a retried batch never duplicates rows);
+- every stage then applies its folded point increments with unordered
+  bulk_writes: league member/league totals, window rollups.
+
+Each stage keeps its own pending increments, so a failing stage is retried
+on the next flush without replaying the stages that already succeeded. The
+increments are not idempotent: a write whose outcome is unknown (e.g. a
+network error mid-bulk) is retried in full, so stage updates are delivered
+at least once and can occasionally be double-counted. On
+shutdown the queue drains; anything that still cannot be written is spilled
+to an NDJSON file that is replayed on the next start. Workers share the spill
+file, so writes and replays take an flock on spill_path + '.lock'.
+"""
+import fcntl
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from bson import json_util
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+def _fold(pending, key, points, timestamp):
+    queued, queued_ts = pending.get(key, (0, None))
+    pending[key] = (queued + points, max(queued_ts, timestamp) if queued_ts else timestamp)
+
+
+def _failed_indexes(error):
+    return {err['index'] for err in error.details.get('writeErrors', [])}
+
+
+class IngestStage:
+    """Folds results into keyed point increments and writes them.
+
+    keys(result) names the buckets a result adds its points to; write(db,
+    folded) applies {key: (points, last_timestamp)} and returns the subset
+    that failed and must be retried.
+    """
+    name = None
+
+    def keys(self, result):
+        return (result['telegram_id'],)
+
+    def write(self, db, folded):
+        raise NotImplementedError
+
+
+class LeagueTotalsStage(IngestStage):
+    """Fans each user's points out to their leagues through the membership index.
+
+    Adds to league_members.points (the per-league leaderboard) and to
+    leagues.points (the league total). Pending keys are user ids; a failed
+    write comes back as ('member', league_id, user_id) or ('league', league_id)
+    with its own points, so updates the server reported as failed are retried
+    on their own. When the outcome of a bulk write is unknown (a network error
+    part way through), all of its updates are retried, so an increment can be
+    applied twice: delivery is at-least-once.
+    """
+    name = 'leagues'
+
+    def _bulk_write(self, collection, keys, operations):
+        """Runs the updates and returns the indexes of those that failed or may have."""
+        if not operations:
+            return set()
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            return _failed_indexes(e)
+        except Exception as e:
+            print(f"Error updating {collection.name}: {e}")
+            return set(range(len(keys)))
+        return set()
+
+    def write(self, db, folded):
+        member_points = {}
+        league_points = {}
+        user_ids = []
+        for key, (points, timestamp) in folded.items():
+            if isinstance(key, tuple) and key[0] == 'member':
+                _fold(member_points, key[1:], points, timestamp)
+            elif isinstance(key, tuple) and key[0] == 'league':
+                _fold(league_points, key[1], points, timestamp)
+            else:
+                user_ids.append(key)
+
+        if user_ids:
+            for m in db.league_members.find({'telegram_id': {'$in': user_ids}}, {'_id': 0, 'league_id': 1, 'telegram_id': 1}):
+                points, timestamp = folded[m['telegram_id']]
+                _fold(member_points, (m['league_id'], m['telegram_id']), points, timestamp)
+                _fold(league_points, m['league_id'], points, timestamp)
+
+        failed = {}
+        member_keys = list(member_points)
+        member_ops = [UpdateOne({'league_id': lid, 'telegram_id': uid}, {'$inc': {'points': member_points[(lid, uid)][0]}}) for lid, uid in member_keys]
+        for i in self._bulk_write(db.league_members, member_keys, member_ops):
+            failed[('member',) + member_keys[i]] = member_points[member_keys[i]]
+
+        league_ids = list(league_points)
+        league_ops = [UpdateOne({'_id': lid}, {'$inc': {'points': league_points[lid][0]}}) for lid in league_ids]
+        for i in self._bulk_write(db.leagues, league_ids, league_ops):
+            failed[('league', league_ids[i])] = league_points[league_ids[i]]
+
+        return failed
+
+
+class ScoreIngestQueue:
+
+    def __init__(self, db, flush_size=500, flush_interval=1.0, spill_path=None, stages=None):
+        self.db = db
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.stages = stages if stages is not None else [LeagueTotalsStage()]
+        self._results = deque()
+        self._pending = {stage.name: {} for stage in self.stages}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushed_results = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='score-ingest', daemon=True)
+            self._thread.start()
+        return self
+
+    def __len__(self):
+        return len(self._results)
+
+    def submit(self, result_doc):
+        """Queues one result document; returns immediately."""
+        result_doc.setdefault('_id', ObjectId())
+        with self._lock:
+            self._results.append(result_doc)
+            for stage in self.stages:
+                pending = self._pending[stage.name]
+                for key in stage.keys(result_doc):
+                    _fold(pending, key, result_doc['points'], result_doc['timestamp'])
+            queued = len(self._results)
+        if queued >= self.flush_size:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Score ingest flush failed: {e}")
+
+    def _take(self):
+        with self._lock:
+            results = list(self._results)
+            self._results.clear()
+            pending = self._pending
+            self._pending = {stage.name: {} for stage in self.stages}
+        return results, pending
+
+    def _requeue(self, results, pending):
+        with self._lock:
+            self._results.extendleft(reversed(results))
+            for name, folded in pending.items():
+                for key, (points, timestamp) in folded.items():
+                    _fold(self._pending[name], key, points, timestamp)
+
+    def flush(self):
+        """Writes everything queued so far. Returns the number of results written."""
+        with self._flush_lock:
+            results, pending = self._take()
+            if not results and not any(pending.values()):
+                return 0
+            try:
+                if results:
+                    self._write_results(results)
+            except Exception:
+                self.failed_flushes += 1
+                self._requeue(results, pending)
+                raise
+
+            errors = []
+            for stage in self.stages:
+                folded = pending[stage.name]
+                if not folded:
+                    continue
+                try:
+                    failed = stage.write(self.db, folded)
+                    if failed:
+                        errors.append(f"{len(failed)} {stage.name} updates failed")
+                except Exception as e:
+                    failed = folded
+                    errors.append(f"{stage.name}: {e}")
+                if failed:
+                    self._requeue([], {stage.name: failed})
+            if errors:
+                self.failed_flushes += 1
+                raise RuntimeError('; '.join(errors))
+            self.flushes += 1
+            return len(results)
+
+    def _write_results(self, results):
+        try:
+            self.db.results.insert_many(results, ordered=False)
+        except BulkWriteError as e:
+            # Rows already written by an earlier, partly failed flush come back as duplicates
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY]
+            if errors:
+                raise
+        self.flushed_results += len(results)
+
+    def close(self):
+        """Stops the flusher, drains the queue and spills anything left to disk."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.flush_interval * 2, 5))
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Score ingest drain failed, spilling to disk: {e}")
+        self._spill()
+
+    @contextmanager
+    def _spill_lock(self):
+        """Serializes spill writes and replays across every process sharing spill_path."""
+        with open(self.spill_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _spill(self):
+        results, pending = self._take()
+        updates = sum(len(folded) for folded in pending.values())
+        if not results and not updates:
+            return
+        if not self.spill_path:
+            print(f"Score ingest dropped {len(results)} results and {updates} pending updates: no spill path configured.")
+            return
+        with self._spill_lock(), open(self.spill_path, 'a', encoding='utf-8') as f:
+            for doc in results:
+                f.write(json_util.dumps({'result': doc}) + '\n')
+            for name, folded in pending.items():
+                for key, (points, timestamp) in folded.items():
+                    f.write(json_util.dumps({'stage': name, 'key': key, 'points': points, 'timestamp': timestamp}) + '\n')
+        print(f"Score ingest spilled {len(results)} results and {updates} pending updates to {self.spill_path}.")
+
+    def replay_spill(self):
+        """Re-queues whatever earlier shutdowns spilled to disk and flushes it.
+
+        The spill is moved into this queue under the spill lock, so workers
+        booting together replay it once and a worker spilling meanwhile waits.
+        If the flush then fails the data stays queued: the flusher retries it
+        and close() spills it again. A .replaying file left by an interrupted
+        replay is picked up too. Returns the number of results re-queued.
+        """
+        if not self.spill_path:
+            return 0
+        results, pending = [], {stage.name: {} for stage in self.stages}
+        with self._spill_lock():
+            paths = [path for path in (self.spill_path + '.replaying', self.spill_path) if os.path.exists(path)]
+            for path in paths:
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json_util.loads(line)
+                        if 'result' in entry:
+                            results.append(entry['result'])
+                        elif entry['stage'] in pending:
+                            key = tuple(entry['key']) if isinstance(entry['key'], list) else entry['key']
+                            _fold(pending[entry['stage']], key, entry['points'], entry['timestamp'])
+            self._requeue(results, pending)
+            for path in paths:
+                os.remove(path)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Replayed score results stay queued, flush failed: {e}")
+        return len(results)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'pending': len(self._results),
+                'pending_updates': {name: len(folded) for name, folded in self._pending.items()},
+            }
+        stats.update({
+            'flushed_results': self.flushed_results,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+        })
+        return stats
@@ -0,0 +1,147 @@
+"""Pre-bucketed score rollups for daily, weekly and season leaderboards.
+
+Every result adds its points to one score_rollups document per window:
+(window, bucket, telegram_id), e.g. ('week', '2026-W42', '12345'). The score
+ingest queue applies these as $inc upserts, a TTL index drops buckets once
+they are past their retention, and a windowed leaderboard is just an index
+walk over the current bucket - the same cost as the all-time board.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from rank_engine import RankEngine
+from score_ingest import IngestStage
+
+WINDOWS = ('day', 'week', 'season')
+# Football seasons run August to May by default
+SEASON_START_MONTH = int(os.environ.get("SEASON_START_MONTH", 8))
+RETENTION = {
+    'day': timedelta(days=7),
+    'week': timedelta(weeks=4),
+    'season': timedelta(days=365),
+}
+
+
+def bucket_for(window, ts):
+    if window == 'day':
+        return ts.strftime('%Y-%m-%d')
+    if window == 'week':
+        year, week, _ = ts.isocalendar()
+        return f"{year}-W{week:02d}"
+    start_year = ts.year if ts.month >= SEASON_START_MONTH else ts.year - 1
+    return f"{start_year}-{(start_year + 1) % 100:02d}"
+
+
+def bucket_end(window, ts):
+    """First instant after the bucket containing ts."""
+    day = datetime(ts.year, ts.month, ts.day)
+    if window == 'day':
+        return day + timedelta(days=1)
+    if window == 'week':
+        return day + timedelta(days=7 - ts.isoweekday() + 1)
+    start_year = ts.year if ts.month >= SEASON_START_MONTH else ts.year - 1
+    return datetime(start_year + 1, SEASON_START_MONTH, 1)
+
+
+class RollupStage(IngestStage):
+    """Score ingest stage: $inc-upserts one rollup per window for each user."""
+    name = 'rollups'
+
+    def keys(self, result):
+        ts = result['timestamp']
+        return [(window, bucket_for(window, ts), result['telegram_id']) for window in WINDOWS]
+
+    def write(self, db, folded):
+        keys = list(folded)
+        written_at = datetime.utcnow()
+        operations = []
+        for window, bucket, user_id in keys:
+            points, timestamp = folded[(window, bucket, user_id)]
+            operations.append(UpdateOne(
+                {'window': window, 'bucket': bucket, 'telegram_id': user_id},
+                {
+                    '$inc': {'points': points},
+                    '$set': {'updated_at': written_at},
+                    '$setOnInsert': {'expires_at': bucket_end(window, timestamp) + RETENTION[window]}
+                },
+                upsert=True
+            ))
+        try:
+            db.score_rollups.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            return {keys[err['index']]: folded[keys[err['index']]] for err in e.details.get('writeErrors', [])}
+        return {}
+
+
+class WindowRanks:
+    """One RankEngine per window, for the window's current bucket.
+
+    When the clock moves into a new bucket the window's engine is replaced
+    with one seeded from that bucket's rollups. sync() pulls in rollups other
+    workers wrote since the last sync and, within preseed_ahead seconds of a
+    bucket boundary, seeds the next bucket's engine off the request path, so
+    the rollover is just a swap.
+    """
+
+    def __init__(self, rollups_collection, preseed_ahead=60):
+        self._rollups = rollups_collection
+        self.preseed_ahead = preseed_ahead
+        self._engines = {}
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def _seed(self, window, bucket):
+        engine = RankEngine()
+        cursor = self._rollups.find({'window': window, 'bucket': bucket}, {'_id': 0, 'telegram_id': 1, 'points': 1})
+        engine.seed((r['telegram_id'], r.get('points')) for r in cursor)
+        return engine
+
+    def engine(self, window, now=None):
+        """Returns (bucket, engine) for the window's current bucket."""
+        bucket = bucket_for(window, now or datetime.utcnow())
+        current = self._engines.get(window)
+        if current is not None and current[0] == bucket:
+            return current
+        # Only one thread rolls the window over; the rest wait and reuse its engine
+        with self._lock:
+            current = self._engines.get(window)
+            if current is not None and current[0] == bucket:
+                return current
+            ready = self._next.pop(window, None)
+            current = ready if ready is not None and ready[0] == bucket else (bucket, self._seed(window, bucket))
+            self._engines[window] = current
+            return current
+
+    def increment(self, user_id, points, ts):
+        for window in WINDOWS:
+            _, engine = self.engine(window, ts)
+            engine.increment(user_id, points)
+
+    def _preseed(self, window, now):
+        boundary = bucket_end(window, now)
+        if (boundary - now).total_seconds() > self.preseed_ahead:
+            return
+        bucket = bucket_for(window, boundary)
+        ready = self._next.get(window)
+        if ready is None or ready[0] != bucket:
+            self._next[window] = (bucket, self._seed(window, bucket))
+
+    def sync(self, since, now=None):
+        """Applies rollups of the current buckets updated at or after since. Returns how many were read."""
+        now = now or datetime.utcnow()
+        count = 0
+        for window in WINDOWS:
+            bucket, engine = self.engine(window, now)
+            cursor = self._rollups.find(
+                {'window': window, 'bucket': bucket, 'updated_at': {'$gte': since}},
+                {'_id': 0, 'telegram_id': 1, 'points': 1}
+            )
+            for r in cursor:
+                engine.update(r['telegram_id'], r.get('points'))
+                count += 1
+            self._preseed(window, now)
+        return count
@@ -0,0 +1,67 @@
+"""Compact HMAC-signed session tokens.
+
+A token is `<telegram_id>.<expiry>.<signature>`: the expiry is a unix
+timestamp in base 36 and the signature is a truncated, base64url HMAC-SHA256
+over the first two parts. Verification needs only the secret - no request
+body and no database - and recently verified tokens are remembered in a small
+LRU so the hot routes skip even the HMAC.
+"""
+import base64
+import hashlib
+import hmac
+import time
+
+from ttl_cache import TTLCache
+
+SIGNATURE_BYTES = 16
+
+
+def _b36(value):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    out = ''
+    while True:
+        value, rem = divmod(value, 36)
+        out = digits[rem] + out
+        if not value:
+            return out
+
+
+class SessionTokens:
+
+    def __init__(self, secret, ttl=7 * 24 * 3600, cache_size=10000, cache_ttl=300):
+        self._key = hashlib.sha256(b'session-token:' + secret.encode()).digest()
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self._verified = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def _sign(self, payload):
+        digest = hmac.new(self._key, payload.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def issue(self, user_id):
+        """Returns (token, expires_at_unix) for user_id."""
+        expires_at = int(time.time()) + self.ttl
+        payload = f"{user_id}.{_b36(expires_at)}"
+        return f"{payload}.{self._sign(payload)}", expires_at
+
+    def verify(self, token):
+        """Returns the token's user id, or None if it is malformed, forged or expired."""
+        cached = self._verified.get(token)
+        if cached is not None:
+            return cached
+
+        parts = token.rsplit('.', 2)
+        if len(parts) != 3:
+            return None
+        user_id, expiry, signature = parts
+        if not hmac.compare_digest(self._sign(f"{user_id}.{expiry}"), signature):
+            return None
+        try:
+            remaining = int(expiry, 36) - time.time()
+        except ValueError:
+            return None
+        if remaining <= 0 or not user_id:
+            return None
+
+        self._verified.set(token, user_id, ttl=min(self.cache_ttl, remaining))
+        return user_id
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The server modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def mongo_client():
+    """A mongomock client with the shims benchmark.py applies for the app."""
+    import benchmark
+    return benchmark.use_mongomock()()
+
+
+@pytest.fixture
+def db(mongo_client):
+    yield mongo_client.test_database
+    mongo_client.drop_database('test_database')
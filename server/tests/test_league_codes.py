@@ -0,0 +1,76 @@
+import pytest
+
+import league_codes
+from league_codes import CODE_ALPHABET, CODE_LENGTH, CODE_SPACE, FEISTEL_ROUNDS, CodeAllocationError, LeagueCodeAllocator
+
+
+class SmallAllocator(LeagueCodeAllocator):
+    """The same Feistel rounds over a 16-bit block, small enough to check exhaustively."""
+
+    def _permute32(self, value):
+        left, right = value >> 8, value & 0xFF
+        for r in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ (self._round(r, right) & 0xFF)
+        return (left << 8) | right
+
+
+def test_cycle_walking_is_a_bijection_on_the_code_space(monkeypatch):
+    # A code space well below the block size makes most values walk several cycles
+    monkeypatch.setattr(league_codes, 'CODE_SPACE', 20000)
+    allocator = SmallAllocator(None, 'secret')
+    assert sorted({allocator._permute32(v) for v in range(1 << 16)}) == list(range(1 << 16))
+    assert sorted(allocator.permute(v) for v in range(20000)) == list(range(20000))
+
+
+def test_permute_stays_in_range_without_collisions():
+    allocator = LeagueCodeAllocator(None, 'secret')
+    values = [allocator.permute(counter) for counter in range(50000)]
+    assert len(set(values)) == len(values)
+    assert all(0 <= v < CODE_SPACE for v in values)
+    assert values[:100] != list(range(100))
+
+
+def test_permutation_depends_on_the_secret():
+    first, second = LeagueCodeAllocator(None, 'one'), LeagueCodeAllocator(None, 'two')
+    assert [first.permute(c) for c in range(20)] == [LeagueCodeAllocator(None, 'one').permute(c) for c in range(20)]
+    assert [first.permute(c) for c in range(20)] != [second.permute(c) for c in range(20)]
+
+
+def test_encode_covers_the_alphabet():
+    assert LeagueCodeAllocator.encode(0) == CODE_ALPHABET[0] * CODE_LENGTH
+    assert LeagueCodeAllocator.encode(CODE_SPACE - 1) == CODE_ALPHABET[-1] * CODE_LENGTH
+    sample = range(0, CODE_SPACE, CODE_SPACE // 1000)
+    assert len({LeagueCodeAllocator.encode(v) for v in sample}) == len(sample)
+
+
+def test_codes_come_from_reserved_blocks(db):
+    allocator = LeagueCodeAllocator(db.counters, 'secret', block_size=10)
+    codes = [allocator.next_code() for _ in range(25)]
+    assert len(set(codes)) == 25
+    assert allocator.block_refills == 3
+    assert db.counters.find_one({'_id': 'league_code'})['value'] == 30
+
+    # Another worker reserves the next block, so its codes never repeat these
+    other = LeagueCodeAllocator(db.counters, 'secret', block_size=10)
+    assert not set(other.next_code() for _ in range(10)) & set(codes)
+
+
+def test_insert_retries_past_a_taken_code(db):
+    db.leagues.create_index('code', unique=True)
+    allocator = LeagueCodeAllocator(db.counters, 'secret', block_size=5)
+    taken = LeagueCodeAllocator.encode(allocator.permute(0))
+    db.leagues.insert_one({'name': 'legacy', 'code': taken})
+
+    allocator.insert_with_code(db.leagues, {'name': 'new'})
+    assert allocator.collisions == 1
+    assert db.leagues.find_one({'name': 'new'})['code'] != taken
+
+
+def test_exhausted_code_space_raises(db):
+    # The next block straddles the end of the code space: three codes left, then none
+    db.counters.insert_one({'_id': 'league_code', 'value': CODE_SPACE - 3})
+    allocator = LeagueCodeAllocator(db.counters, 'secret', block_size=5)
+    for _ in range(3):
+        allocator.next_code()
+    with pytest.raises(CodeAllocationError):
+        allocator.next_code()
@@ -0,0 +1,138 @@
+import random
+
+import pytest
+
+from rank_engine import RankEngine, SkipList
+
+
+def check_spans(skiplist, reference):
+    """Every level's spans must add up to the true distance between its nodes."""
+    assert len(skiplist) == len(reference)
+    assert list(skiplist.iter_from(0)) == reference
+    positions = {key: i + 1 for i, key in enumerate(reference)}
+    for level in range(skiplist.level):
+        node, position = skiplist.head, 0
+        while node.forward[level] is not None:
+            position += node.span[level]
+            node = node.forward[level]
+            assert positions[node.key] == position
+        assert position + node.span[level] == len(reference)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_skiplist_matches_sorted_reference(seed):
+    rng = random.Random(seed)
+    skiplist, reference = SkipList(), []
+    for _ in range(3000):
+        key = (rng.randint(-40, 0), str(rng.randint(0, 400)))
+        if key in reference:
+            assert skiplist.remove(key)
+            reference.remove(key)
+        else:
+            skiplist.insert(key)
+            reference.append(key)
+            reference.sort()
+    check_spans(skiplist, reference)
+    for i, key in enumerate(reference):
+        assert skiplist.count_less(key) == i
+        assert next(skiplist.iter_from(i)) == key
+    assert not skiplist.remove((1, 'missing'))
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 17, 2000])
+def test_from_sorted_builds_the_same_list_as_inserts(size):
+    rng = random.Random(size)
+    reference = sorted({(rng.randint(-100, 0), str(rng.randint(0, 10 ** 6))) for _ in range(size)})
+    skiplist = SkipList.from_sorted(reference)
+    check_spans(skiplist, reference)
+
+    # A bulk-built list keeps working under inserts and removes
+    for _ in range(500):
+        key = (rng.randint(-100, 0), str(rng.randint(0, 10 ** 6)))
+        if key in reference:
+            skiplist.remove(key)
+            reference.remove(key)
+        else:
+            skiplist.insert(key)
+            reference.append(key)
+            reference.sort()
+    check_spans(skiplist, reference)
+
+
+def leaderboard(scores):
+    return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+
+
+@pytest.fixture
+def engine_and_scores():
+    rng = random.Random(7)
+    engine, scores = RankEngine(), {}
+    engine.seed((str(i), rng.randint(0, 30)) for i in range(300))
+    scores.update(engine._scores)
+    for _ in range(1000):
+        member = str(rng.randint(0, 350))
+        if rng.random() < 0.5:
+            scores[member] = rng.randint(0, 30)
+            engine.update(member, scores[member])
+        else:
+            delta = rng.randint(-5, 5)
+            scores[member] = scores.get(member, 0) + delta
+            assert engine.increment(member, delta) == scores[member]
+    return engine, scores
+
+
+def test_rank_and_position(engine_and_scores):
+    engine, scores = engine_and_scores
+    order = leaderboard(scores)
+    assert len(engine) == len(scores)
+    for position, (member, score) in enumerate(order):
+        assert engine.position(member) == position
+        assert engine.rank(member) == 1 + sum(1 for s in scores.values() if s > score)
+    assert engine.rank('nobody') is None
+    assert engine.position('nobody') is None
+
+
+@pytest.mark.parametrize('page_size', [1, 7, 50])
+def test_keyset_pages_start_at_engine_positions(engine_and_scores, page_size):
+    """Walking keyset pages, position_after(cursor) is the position of the next page's first row."""
+    engine, scores = engine_and_scores
+    order = leaderboard(scores)
+    start = 0
+    while start < len(order):
+        page = order[start:start + page_size]
+        last_member, last_score = page[-1]
+        start += len(page)
+        assert engine.position_after(last_score, last_member) == start
+
+
+def test_position_after_for_a_stale_cursor():
+    engine = RankEngine()
+    engine.seed([('a', 10), ('b', 8), ('c', 5)])
+    # The cursor's user has since moved; the page still starts after (8, 'b') in order
+    engine.update('b', 20)
+    assert engine.position_after(8, 'b') == 2
+    assert engine.position_after(8, 'bb') == 2
+
+
+def test_snapshot_records_leaderboard_order(engine_and_scores, monkeypatch):
+    import rank_engine
+    monkeypatch.setattr(rank_engine, 'SNAPSHOT_SORT_RUN', 16)
+    engine, scores = engine_and_scores
+    snapshot = engine.snapshot()
+    assert snapshot.members == [member for member, _ in leaderboard(scores)]
+    assert snapshot.rank(snapshot.members[0]) == 1
+    assert snapshot.rank('nobody') is None
+
+
+def test_seed_from_collection_and_verify(db):
+    db.users.insert_many([{'telegram_id': str(i), 'overall_score': (i * 37) % 11} for i in range(200)])
+    db.users.insert_one({'telegram_id': '999'})
+    engine = RankEngine()
+    assert engine.seed_from_collection(db.users) == 201
+    assert engine.position('999') == 200
+    assert engine.verify_against(db.users)['consistent']
+
+    engine.update('3', 1000)
+    report = engine.verify_against(db.users, repair=True)
+    assert report['mismatched_count'] == 1 and report['repaired']
+    assert engine.verify_against(db.users)['consistent']
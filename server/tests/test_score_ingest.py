@@ -0,0 +1,174 @@
+from datetime import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from score_ingest import LeagueTotalsStage, ScoreIngestQueue
+from score_rollups import RollupStage
+
+NOW = datetime(2026, 10, 14, 12, 0, 0)
+
+
+def down(*args, **kwargs):
+    raise AutoReconnect('connection refused')
+
+
+@pytest.fixture
+def leagues(db):
+    db.leagues.insert_many([{'_id': 'L1', 'points': 0}, {'_id': 'L2', 'points': 0}])
+    db.league_members.insert_many([
+        {'league_id': 'L1', 'telegram_id': 'a', 'points': 0},
+        {'league_id': 'L2', 'telegram_id': 'a', 'points': 0},
+        {'league_id': 'L1', 'telegram_id': 'b', 'points': 0},
+    ])
+    return db
+
+
+def make_queue(db, tmp_path, **kwargs):
+    return ScoreIngestQueue(db, spill_path=str(tmp_path / 'spill.ndjson'), stages=[LeagueTotalsStage(), RollupStage()], **kwargs)
+
+
+def submit(queue, user_id, points):
+    queue.submit({'telegram_id': user_id, 'quiz_id': 'q', 'points': points, 'timestamp': NOW})
+
+
+def totals(db):
+    return (
+        {l['_id']: l['points'] for l in db.leagues.find()},
+        {(m['league_id'], m['telegram_id']): m['points'] for m in db.league_members.find()},
+        {(r['window'], r['telegram_id']): r['points'] for r in db.score_rollups.find()},
+    )
+
+
+def test_flush_writes_results_and_stage_totals(leagues, tmp_path):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'a', 5)
+    submit(queue, 'b', 2)
+    submit(queue, 'a', 1)
+    assert queue.flush() == 3
+    assert len(queue) == 0 and queue.flush() == 0
+
+    league_points, member_points, rollups = totals(leagues)
+    assert leagues.results.count_documents({}) == 3
+    assert league_points == {'L1': 8, 'L2': 6}
+    assert member_points == {('L1', 'a'): 6, ('L2', 'a'): 6, ('L1', 'b'): 2}
+    assert rollups[('week', 'a')] == 6 and rollups[('day', 'b')] == 2
+
+
+def test_failed_result_insert_requeues_everything(leagues, tmp_path, monkeypatch):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'a', 5)
+    monkeypatch.setattr(leagues.results, 'insert_many', down)
+    with pytest.raises(AutoReconnect):
+        queue.flush()
+    assert len(queue) == 1
+    assert queue.stats()['pending_updates'] == {'leagues': 1, 'rollups': 3}
+
+    monkeypatch.undo()
+    assert queue.flush() == 1
+    assert totals(leagues)[0] == {'L1': 5, 'L2': 5}
+
+
+def test_retried_results_are_not_duplicated(leagues, tmp_path, monkeypatch):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'a', 5)
+    insert_many = leagues.results.insert_many
+
+    def insert_then_fail(docs, **kwargs):
+        insert_many(docs, **kwargs)
+        raise AutoReconnect('reply lost')
+
+    monkeypatch.setattr(leagues.results, 'insert_many', insert_then_fail)
+    with pytest.raises(AutoReconnect):
+        queue.flush()
+    monkeypatch.undo()
+    queue.flush()
+    assert leagues.results.count_documents({}) == 1
+
+
+def test_league_stage_retries_only_the_failed_league_update(leagues, tmp_path, monkeypatch):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'a', 5)
+    submit(queue, 'b', 2)
+    bulk_write = leagues.leagues.bulk_write
+    calls = []
+
+    def fail_first_league(operations, **kwargs):
+        calls.append(len(operations))
+        if len(calls) > 1:
+            return bulk_write(operations, **kwargs)
+        bulk_write(operations[1:], **kwargs)
+        raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 1, 'errmsg': 'failed'}]})
+
+    monkeypatch.setattr(leagues.leagues, 'bulk_write', fail_first_league)
+    with pytest.raises(RuntimeError):
+        queue.flush()
+    assert queue.stats()['pending_updates'] == {'leagues': 1, 'rollups': 0}
+
+    queue.flush()
+    assert calls == [2, 1]
+    league_points, member_points, _ = totals(leagues)
+    assert league_points == {'L1': 7, 'L2': 5}
+    assert member_points == {('L1', 'a'): 5, ('L2', 'a'): 5, ('L1', 'b'): 2}
+
+
+def test_close_spills_and_next_start_replays(leagues, tmp_path, monkeypatch):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'a', 5)
+    monkeypatch.setattr(leagues.results, 'insert_many', down)
+    queue.close()
+    assert (tmp_path / 'spill.ndjson').exists()
+    monkeypatch.undo()
+
+    restarted = make_queue(leagues, tmp_path)
+    assert restarted.replay_spill() == 1
+    assert not (tmp_path / 'spill.ndjson').exists()
+    assert leagues.results.count_documents({}) == 1
+    assert totals(leagues)[0] == {'L1': 5, 'L2': 5}
+
+
+def test_failed_replay_keeps_the_data(leagues, tmp_path, monkeypatch):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'a', 5)
+    monkeypatch.setattr(leagues.results, 'insert_many', down)
+    queue.close()
+
+    # Mongo is still down when the next worker boots: the replay stays queued, then spills again
+    replaying = make_queue(leagues, tmp_path)
+    assert replaying.replay_spill() == 1
+    assert len(replaying) == 1
+    replaying.close()
+    monkeypatch.undo()
+
+    healthy = make_queue(leagues, tmp_path)
+    assert healthy.replay_spill() == 1
+    assert leagues.results.count_documents({}) == 1
+    assert totals(leagues)[0] == {'L1': 5, 'L2': 5}
+
+
+def test_replay_picks_up_a_leftover_replaying_file(leagues, tmp_path, monkeypatch):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'b', 2)
+    monkeypatch.setattr(leagues.results, 'insert_many', down)
+    queue.close()
+    monkeypatch.undo()
+    (tmp_path / 'spill.ndjson').rename(tmp_path / 'spill.ndjson.replaying')
+
+    assert make_queue(leagues, tmp_path).replay_spill() == 1
+    assert not (tmp_path / 'spill.ndjson.replaying').exists()
+    assert totals(leagues)[1][('L1', 'b')] == 2
+
+
+def test_failed_stage_updates_survive_a_spill(leagues, tmp_path, monkeypatch):
+    queue = make_queue(leagues, tmp_path)
+    submit(queue, 'a', 5)
+    monkeypatch.setattr(leagues.leagues, 'bulk_write', down)
+    queue.close()
+    monkeypatch.undo()
+
+    # Results and member totals were written; only the league totals were spilled
+    assert leagues.results.count_documents({}) == 1
+    assert make_queue(leagues, tmp_path).replay_spill() == 0
+    league_points, member_points, _ = totals(leagues)
+    assert league_points == {'L1': 5, 'L2': 5}
+    assert member_points == {('L1', 'a'): 5, ('L2', 'a'): 5, ('L1', 'b'): 0}